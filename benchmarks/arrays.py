@@ -0,0 +1,48 @@
+"""
+Record format of ExtDirectStore: dicts vs arrays (`arrays=True`), on the wide
+model of serializer.py (30 columns) stored in SQLite.
+
+For each page size we build the page (query + records) and encode it as JSON.
+`values` are the stores built from `values_list()`, where the arrays are
+built directly from the rows.
+"""
+from common import best_of, report, setup_db
+from serializer import WideModel, build_objects
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from extdirect.django import ExtDirectStore
+from extdirect.django.bulk import bulk_insert
+from extdirect.django.encoders import get_encoder
+
+@transaction.commit_on_success
+def create_table(count):
+    cursor = connection.cursor()
+    for sql in connection.creation.sql_create_model(WideModel, no_style())[0]:
+        cursor.execute(sql)
+    bulk_insert(WideModel, build_objects(count))
+
+def main():
+    setup_db()
+    create_table(5000)
+    encoder = get_encoder()
+    stores = [
+        ('dicts', ExtDirectStore(WideModel)),
+        ('arrays', ExtDirectStore(WideModel, arrays=True)),
+        ('values dicts', ExtDirectStore(WideModel, values=True)),
+        ('values arrays', ExtDirectStore(WideModel, values=True, arrays=True)),
+    ]
+    rows = []
+    for limit in (50, 500, 5000):
+        row = [limit]
+        sizes = []
+        for name, store in stores:
+            page = lambda: encoder.encode(store.query(start=0, limit=limit))
+            row.append('%.2f' % best_of(page))
+            sizes.append(len(page()))
+        rows.append(row + [sizes[0], sizes[1], '%.0f%%' % (100.0 * sizes[1] / sizes[0])])
+    report('Page of a %d columns model, query + encoding (ms)' % len(WideModel._meta.fields), rows,
+           ['records'] + [name for name, store in stores] + ['dict bytes', 'array bytes', 'size'])
+
+if __name__ == '__main__':
+    main()
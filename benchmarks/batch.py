@@ -0,0 +1,40 @@
+"""
+Sequential vs concurrent dispatch of a batch of Ext.Direct calls.
+
+Every call simulates an 80ms grid load (I/O bound, so it releases the GIL).
+"""
+import time
+from common import post_request, best_of, report
+
+from django.utils import simplejson
+from extdirect.django import ExtRemotingProvider
+
+DELAY = 0.08
+
+def build_provider(concurrent_batch, max_workers):
+    provider = ExtRemotingProvider('bench', '/router/', concurrent_batch=concurrent_batch,
+                                   max_workers=max_workers)
+    def load(request):
+        time.sleep(DELAY)
+        return {'success': True}
+    provider.register(load, 'grid', 'load', 1)
+    return provider
+
+def batch(size):
+    return simplejson.dumps([{'action': 'grid', 'method': 'load', 'tid': i,
+                              'data': [{}], 'type': 'rpc'} for i in range(size)])
+
+def main():
+    rows = []
+    for size in (1, 2, 5, 10):
+        body = batch(size)
+        row = [size]
+        for concurrent_batch, max_workers in ((False, 1), (True, 4), (True, 10)):
+            provider = build_provider(concurrent_batch, max_workers)
+            row.append('%.1f' % best_of(lambda: provider.router(post_request(body)), repeat=3))
+        rows.append(row)
+    report('Batch latency (ms), %dms per call' % (DELAY * 1000), rows,
+           ['calls', 'sequential', 'concurrent(4)', 'concurrent(10)'])
+
+if __name__ == '__main__':
+    main()
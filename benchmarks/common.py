@@ -0,0 +1,78 @@
+"""
+Shared setup for the extdirect.django benchmarks.
+
+The benchmarks are plain scripts, run them from the top of the checkout::
+
+    $ python benchmarks/batch.py
+
+They configure Django with a temporary SQLite database, so they don't need
+a project or a settings module.
+"""
+import os, sys, time, tempfile
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=False,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                #Not :memory: because every thread has its own connection
+                'NAME': os.path.join(tempfile.mkdtemp(), 'benchmarks.db'),
+            }
+        },
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'extdirect.django',
+        ),
+        SERIALIZATION_MODULES={
+            'extdirect': 'extdirect.django.serializer'
+        },
+    )
+
+def setup_db():
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+def post_request(body, content_type='application/json', **extra):
+    """
+    Build a POST request as the WSGI handler would do it.
+    """
+    from django.core.handlers.wsgi import WSGIRequest
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/router/',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': StringIO(body),
+    }
+    environ.update(extra)
+    return WSGIRequest(environ)
+
+def best_of(func, repeat=5, number=1):
+    """
+    Return the best wall time (in ms) of `repeat` runs of `number` calls to `func`.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        for j in range(number):
+            func()
+        timings.append((time.time() - start) * 1000.0 / number)
+    return min(timings)
+
+def report(title, rows, columns):
+    print title
+    print '-' * len(title)
+    print ''.join(c.rjust(16) for c in columns)
+    for row in rows:
+        print ''.join(str(v).rjust(16) for v in row)
+    print
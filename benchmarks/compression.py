@@ -0,0 +1,38 @@
+"""
+Response compression: CPU time vs bytes, for store payloads of the wide model
+of serializer.py at several sizes, with each gzip level and brotli (if installed).
+
+Every cell it's "ms / % of the original size".
+"""
+from common import best_of, report
+from serializer import build_objects
+
+from extdirect.django.compression import GzipEncoding, BrotliEncoding
+from extdirect.django.encoders import get_encoder
+from extdirect.django.serializer import Serializer
+
+def encodings():
+    found = [('gzip-%d' % level, GzipEncoding(level)) for level in (1, 6, 9)]
+    for quality in (1, 4, 11):
+        try:
+            found.append(('br-%d' % quality, BrotliEncoding(quality)))
+        except ImportError:
+            break
+    return found
+
+def main():
+    available = encodings()
+    rows = []
+    for count in (10, 100, 1000, 10000):
+        content = get_encoder().encode(Serializer().serialize(build_objects(count), total=count))
+        row = ['%dKB' % (len(content) / 1024)]
+        for name, encoding in available:
+            ms = best_of(lambda: encoding.compress(content), repeat=3)
+            ratio = 100.0 * len(encoding.compress(content)) / len(content)
+            row.append('%.2f / %.0f%%' % (ms, ratio))
+        rows.append(row)
+    report('Compression of a store payload (ms / size)', rows,
+           ['payload'] + [name for name, encoding in available])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Dispatch overhead per call, for batches of 1, 10 and 100 calls to a method
+that does nothing (with login_required, so the checks are part of the cost).
+
+LegacyProvider it's the dispatcher used before the compiled RemotingMethods
+(lookups in `actions` for every field and the keys of every dict parameter
+converted after the request was decoded), kept here as the reference.
+"""
+from common import post_request, best_of, report
+
+from django.utils import simplejson
+from extdirect.django import ExtRemotingProvider
+
+class User(object):
+    def is_authenticated(self):
+        return True
+
+class LegacyProvider(ExtRemotingProvider):
+    def dispatcher(self, request, extdirect_req):
+        action = extdirect_req['action']
+        method = extdirect_req['method']
+        func = self.actions[action][method]['func']
+        data = None
+        if not extdirect_req.get('isForm'):
+            data = extdirect_req.pop('data')
+        response = extdirect_req
+        login_required = self.actions[action][method]['login_required']
+        if(login_required):
+            if not request.user.is_authenticated():
+                response['result'] = dict(success=False, message='You must be authenticated to run this method.')
+                return response
+        permission = self.actions[action][method]['permission']
+        if(permission):
+            if not request.user.has_perm(permission):
+                response['result'] = dict(success=False, messsage='You need `%s` permission to run this method' % permission)
+                return response
+        if data:
+            params = []
+            for param in data:
+                if isinstance(param, dict):
+                    param = dict(map(lambda x: (str(x[0]), x[1]), param.items()))
+                params.append(param)
+            request.extdirect_post_data = params
+        response['result'] = func(request)
+        return response
+
+def build_provider(klass):
+    provider = klass('bench', '/router/')
+    def noop(request):
+        return True
+    provider.register(noop, 'grid', 'noop', 1, login_required=True)
+    return provider
+
+def batch(size):
+    return simplejson.dumps([{'action': 'grid', 'method': 'noop', 'tid': i, 'type': 'rpc',
+                              'data': [{'start': 0, 'limit': 25, 'sort': 'name', 'dir': 'ASC'}]}
+                             for i in range(size)])
+
+def main():
+    rows = []
+    for size in (1, 10, 100):
+        body = batch(size)
+        row = [size]
+        for klass in (LegacyProvider, ExtRemotingProvider):
+            provider = build_provider(klass)
+            def run():
+                request = post_request(body)
+                request.user = User()
+                provider.router(request)
+            row.append('%.1f' % (best_of(run, repeat=5, number=200) * 1000 / size))
+        rows.append(row)
+    report('Router time per call (us)', rows, ['calls', 'legacy', 'compiled'])
+
+if __name__ == '__main__':
+    main()
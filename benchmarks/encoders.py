@@ -0,0 +1,44 @@
+"""
+JSON encoding of a realistic store payload (the wide model of serializer.py,
+8 dates and 5 Decimals per record).
+
+`legacy` it's the payload with date and Decimal objects encoded by DjangoJSONEncoder
+(its `default` it's called for every one of them). The other columns encode the
+records built by the `extdirect` serializer, with the values already converted,
+using every encoder installed (see extdirect.django.encoders).
+"""
+from common import best_of, report
+from serializer import WideModel, LegacySerializer, build_objects
+
+from django.core.serializers.json import DjangoJSONEncoder
+from extdirect.django.encoders import ENCODERS, load_encoder
+from extdirect.django.serializer import Serializer
+
+def available():
+    encoders = []
+    for name in sorted(ENCODERS):
+        try:
+            encoders.append((name, load_encoder(name)))
+        except ImportError:
+            pass
+    return encoders
+
+def main():
+    encoders = available()
+    rows = []
+    for count in (50, 500, 5000):
+        objects = build_objects(count)
+        legacy = LegacySerializer().serialize(objects, total=count)
+        payload = Serializer().serialize(objects, total=count)
+        
+        django_encoder = DjangoJSONEncoder()
+        row = [count, '%.2f' % best_of(lambda: django_encoder.encode(legacy))]
+        for name, encoder in encoders:
+            row.append('%.2f' % best_of(lambda: encoder.encode(payload)))
+        row.append(len(django_encoder.encode(payload)))
+        rows.append(row)
+    report('Encoding of a %d columns store payload (ms)' % len(WideModel._meta.fields), rows,
+           ['records', 'legacy'] + [name for name, encoder in encoders] + ['bytes'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Overhead of the dispatcher instrumentation (StatsSink) on a small read.
+"""
+from common import setup_db, post_request, best_of, report
+
+from django.utils import simplejson
+from extdirect.django import ExtRemotingProvider, ExtDirectStore
+from extdirect.django.instrumentation import Instrumentation, StatsSink
+from extdirect.django.models import ExtDirectStoreModel
+
+def build_provider(instrumentation):
+    provider = ExtRemotingProvider('bench', '/router/', instrumentation=instrumentation)
+    store = ExtDirectStore(ExtDirectStoreModel)
+    def read(request):
+        return store.query(start=0, limit=25)
+    def ping(request):
+        return {'success': True}
+    provider.register(read, 'grid', 'read', 1)
+    provider.register(ping, 'grid', 'ping', 1)
+    return provider
+
+def main():
+    setup_db()
+    for i in range(100):
+        ExtDirectStoreModel.objects.create(name='name %d' % i)
+    rows = []
+    for method in ('ping', 'read'):
+        body = simplejson.dumps({'action': 'grid', 'method': method, 'tid': 1,
+                                 'data': [{}], 'type': 'rpc'})
+        row = [method]
+        for instrumentation in (None, Instrumentation(StatsSink())):
+            provider = build_provider(instrumentation)
+            row.append('%.3f' % best_of(lambda: provider.router(post_request(body)),
+                                        repeat=5, number=500))
+        rows.append(row)
+    report('Router time per call (ms)', rows, ['method', 'plain', 'instrumented'])
+
+if __name__ == '__main__':
+    main()
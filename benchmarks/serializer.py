@@ -0,0 +1,82 @@
+"""
+`extdirect` serializer throughput on a wide model (30 columns).
+
+LegacySerializer it's the per-row field lookup used before the field plans,
+kept here as the reference for the comparison. The objects are built in memory,
+so we only measure the serialization.
+"""
+import datetime, decimal
+from common import best_of, report
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils.encoding import smart_unicode
+from extdirect.django.serializer import Serializer
+
+class WideModel(models.Model):
+    class Meta:
+        app_label = 'benchmarks'
+
+for i in range(8):
+    WideModel.add_to_class('char_%d' % i, models.CharField(max_length=50))
+    WideModel.add_to_class('int_%d' % i, models.IntegerField())
+    WideModel.add_to_class('date_%d' % i, models.DateField())
+for i in range(5):
+    WideModel.add_to_class('dec_%d' % i, models.DecimalField(max_digits=10, decimal_places=2))
+
+class LegacySerializer(Serializer):
+    def records(self, queryset, chunk_size=500):
+        for obj in queryset:
+            if self.local_fields:
+                fields = obj._meta.local_fields
+            else:
+                fields = obj._meta.fields
+            fields = [f for f in fields if f.name not in self.exclude_fields]
+            rec = self._current = {}
+            for field in fields:
+                if field.serialize:
+                    if field.rel is None:
+                        if self.selected_fields is None or field.attname in self.selected_fields:
+                            rec[field.name] = smart_unicode(getattr(obj, field.name), strings_only=True)
+                    else:
+                        if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
+                            self.handle_fk_field(obj, field)
+            for field in obj._meta.many_to_many:
+                if field.serialize:
+                    if self.selected_fields is None or field.attname in self.selected_fields:
+                        self.handle_m2m_field(obj, field)
+            rec[self.meta['idProperty']] = smart_unicode(obj._get_pk_val(), strings_only=True)
+            for extra in self.extras:
+                rec[extra[0]] = extra[1](obj)
+            yield rec
+
+def build_objects(count):
+    today = datetime.date.today()
+    objects = []
+    for n in xrange(count):
+        values = {'id': n}
+        for i in range(8):
+            values['char_%d' % i] = u'value %d' % n
+            values['int_%d' % i] = n * i
+            values['date_%d' % i] = today
+        for i in range(5):
+            values['dec_%d' % i] = decimal.Decimal('%d.50' % n)
+        objects.append(WideModel(**values))
+    return objects
+
+def main():
+    rows = []
+    for count in (50, 500, 5000):
+        objects = build_objects(count)
+        legacy = best_of(lambda: LegacySerializer().serialize(objects, total=count))
+        planned = best_of(lambda: Serializer().serialize(objects, total=count))
+        #The dates and Decimals are converted by the field plan, the JSON must be the same
+        encoder = DjangoJSONEncoder()
+        assert encoder.encode(LegacySerializer().serialize(objects, total=count)) == \
+               encoder.encode(Serializer().serialize(objects, total=count))
+        rows.append([count, '%.2f' % legacy, '%.2f' % planned, '%.1fx' % (legacy / planned)])
+    report('Serialization of a %d columns model (ms)' % len(WideModel._meta.fields), rows,
+           ['objects', 'legacy', 'field plan', 'speedup'])
+
+if __name__ == '__main__':
+    main()
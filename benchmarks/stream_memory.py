@@ -0,0 +1,68 @@
+"""
+Peak memory of an unpaginated ExtDirectStore read, buffered vs streaming.
+
+Each mode runs in its own process (peak RSS can't go down), over the same
+SQLite fixture of ROWS records::
+
+    $ python benchmarks/stream_memory.py [ROWS]
+"""
+import os, sys, resource, subprocess
+from common import post_request, report
+
+ROWS = 100000
+
+def create_fixture(path, rows):
+    from django.conf import settings
+    from django.db import connection, transaction
+    settings.DATABASES['default']['NAME'] = path
+    from common import setup_db
+    setup_db()
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM django_extdirectstoremodel')
+    cursor.executemany('INSERT INTO django_extdirectstoremodel (name) VALUES (%s)',
+                       [('Record number %d with some text' % i,) for i in xrange(rows)])
+    transaction.commit_unless_managed()
+
+def run(path, streaming):
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = path
+
+    from django.utils import simplejson
+    from extdirect.django import ExtRemotingProvider, ExtDirectStore
+    from extdirect.django.models import ExtDirectStoreModel
+
+    provider = ExtRemotingProvider('bench', '/router/')
+    store = ExtDirectStore(ExtDirectStoreModel, streaming=streaming)
+    provider.register(lambda request: store.query(**request.extdirect_post_data[0]), 'grid', 'read', 1)
+
+    body = simplejson.dumps({'action': 'grid', 'method': 'read', 'tid': 1, 'data': [{}], 'type': 'rpc'})
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    response = provider.router(post_request(body))
+    size = 0
+    for chunk in response:
+        #the WSGI server would write the chunk to the socket
+        size += len(chunk)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print size, before, peak
+
+def main():
+    rows = len(sys.argv) > 1 and int(sys.argv[1]) or ROWS
+    from django.conf import settings
+    path = settings.DATABASES['default']['NAME']
+    create_fixture(path, rows)
+
+    results = []
+    for streaming in (False, True):
+        out = subprocess.Popen([sys.executable, __file__, '--run', path, str(int(streaming))],
+                               stdout=subprocess.PIPE).communicate()[0]
+        size, before, peak = [int(v) for v in out.split()]
+        results.append(['streaming' if streaming else 'buffered', size / 1024,
+                        (peak - before) / 1024, peak / 1024])
+    report('Unpaginated read of %d records' % rows, results,
+           ['mode', 'response KB', 'RSS growth MB', 'peak RSS MB'])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(sys.argv[2], bool(int(sys.argv[3])))
+    else:
+        main()
@@ -1,5 +1,5 @@
 #
-from providers import ExtRemotingProvider, ExtPollingProvider
+from providers import ExtRemotingProvider, ExtPollingProvider, ExtMultiPollingProvider
 from store import ExtDirectStore
 from crud import ExtDirectCRUD
 from decorators import remoting, polling, crud
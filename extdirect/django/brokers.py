@@ -0,0 +1,157 @@
+"""
+Event brokers for the long-poll mode of ExtPollingProvider.
+
+A broker keeps the events published to each channel (the name of the event),
+numbered with increasing versions, and lets a request wait for new ones:
+
+ - `publish(channel, data)` stores an event and returns its version.
+ - `wait(channel, since, timeout)` returns the events (version, data) of
+   `channel` newer than `since`, waiting at most `timeout` seconds for them.
+   It returns an empty list if nothing was published.
+ - `wait_any(channels, timeout)` it's the same for many channels at once,
+   `channels` it's a dict {channel: since}. It returns a dict {channel: events}
+   with only the channels that got new events.
+ - `latest(channel=None)` returns the last version used (in `channel`, 0 if
+   nothing was published to it).
+
+MemoryBroker works inside a single process. SQLiteBroker shares the events
+between processes (e.g. the workers of a server) using a SQLite file.
+"""
+import time, threading, sqlite3
+
+from django.utils import simplejson
+from django.core.serializers.json import DjangoJSONEncoder
+
+class MemoryBroker(object):
+    """
+    Keep the last `history` events of each channel in memory.
+    """
+    def __init__(self, history=100):
+        self.history = history
+        self.condition = threading.Condition()
+        self.version = 0
+        self.channels = {}
+
+    def publish(self, channel, data=None):
+        self.condition.acquire()
+        try:
+            self.version += 1
+            events = self.channels.setdefault(channel, [])
+            events.append((self.version, data))
+            del events[:-self.history]
+            self.condition.notifyAll()
+            return self.version
+        finally:
+            self.condition.release()
+
+    def latest(self, channel=None):
+        if channel is None:
+            return self.version
+        events = self.channels.get(channel)
+        return events and events[-1][0] or 0
+
+    def _newer(self, channels):
+        found = {}
+        for channel, since in channels.items():
+            events = [event for event in self.channels.get(channel, []) if event[0] > since]
+            if events:
+                found[channel] = events
+        return found
+
+    def wait_any(self, channels, timeout):
+        deadline = time.time() + timeout
+        self.condition.acquire()
+        try:
+            found = self._newer(channels)
+            while not found:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+                found = self._newer(channels)
+            return found
+        finally:
+            self.condition.release()
+
+    def wait(self, channel, since, timeout):
+        return self.wait_any({channel: since}, timeout).get(channel, [])
+
+class SQLiteBroker(object):
+    """
+    Keep the events in the SQLite database `path`, the data it's stored as JSON.
+    The waiting requests look for new events every `interval` seconds.
+    Events older than `keep` seconds are deleted when a new one it's published.
+    """
+    def __init__(self, path, interval=0.5, keep=3600):
+        self.path = path
+        self.interval = interval
+        self.keep = keep
+        connection = self._connect()
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS extdirect_events ('
+                               'version INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'channel TEXT NOT NULL, data TEXT, created REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS extdirect_events_channel '
+                               'ON extdirect_events (channel, version)')
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        #One connection for each call, so the broker could be used by any thread
+        return sqlite3.connect(self.path, timeout=10)
+
+    def publish(self, channel, data=None):
+        connection = self._connect()
+        try:
+            now = time.time()
+            cursor = connection.execute('INSERT INTO extdirect_events (channel, data, created) '
+                                        'VALUES (?, ?, ?)',
+                                        (channel, simplejson.dumps(data, cls=DjangoJSONEncoder), now))
+            version = cursor.lastrowid
+            connection.execute('DELETE FROM extdirect_events WHERE created < ?', (now - self.keep,))
+            connection.commit()
+            return version
+        finally:
+            connection.close()
+
+    def latest(self, channel=None):
+        connection = self._connect()
+        try:
+            if channel is None:
+                row = connection.execute('SELECT MAX(version) FROM extdirect_events').fetchone()
+            else:
+                row = connection.execute('SELECT MAX(version) FROM extdirect_events '
+                                         'WHERE channel = ?', (channel,)).fetchone()
+            return row[0] or 0
+        finally:
+            connection.close()
+
+    def _newer(self, connection, channels):
+        found = {}
+        for channel, since in channels.items():
+            rows = connection.execute('SELECT version, data FROM extdirect_events '
+                                      'WHERE channel = ? AND version > ? ORDER BY version',
+                                      (channel, since))
+            events = [(version, simplejson.loads(data)) for version, data in rows]
+            if events:
+                found[channel] = events
+        return found
+
+    def wait_any(self, channels, timeout):
+        deadline = time.time() + timeout
+        connection = self._connect()
+        try:
+            found = self._newer(connection, channels)
+            while not found:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                time.sleep(min(self.interval, remaining))
+                found = self._newer(connection, channels)
+            return found
+        finally:
+            connection.close()
+
+    def wait(self, channel, since, timeout):
+        return self.wait_any({channel: since}, timeout).get(channel, [])
@@ -0,0 +1,136 @@
+"""
+Batched writes used by ExtDirectCRUD in bulk mode (`bulk_create`, `bulk_update`).
+
+These functions don't call `Model.save()`, so the `pre_save` and `post_save`
+signals are not sent.
+"""
+from django.db import connections, router
+from django.db.models import AutoField
+
+def _engine(connection):
+    return connection.settings_dict['ENGINE'].split('.')[-1]
+
+def _supports_bulk_insert(connection):
+    engine = _engine(connection)
+    if engine == 'sqlite3':
+        #Multi-row VALUES it's supported since SQLite 3.7.11
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 7, 11)
+    #MySQL doesn't guarantee consecutive ids for a multi-row INSERT
+    #(innodb_autoinc_lock_mode=2, replication), there we save row by row
+    return engine.startswith('postgresql')
+
+def _max_params(connection):
+    if _engine(connection) == 'sqlite3':
+        return 999
+    return 10000
+
+def bulk_insert(model, objs, batch_size=100, using=None):
+    """
+    Insert `objs` (unsaved instances of `model`) using multi-row INSERT
+    statements of at most `batch_size` rows, and set their primary keys.
+
+    The primary keys are taken from RETURNING in PostgreSQL and from the
+    last inserted id in SQLite. Inherited models, objects with a primary
+    key already set and other databases (MySQL too) are saved one by one.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    opts = model._meta
+
+    fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    bulk = fields and not opts.parents and isinstance(opts.pk, AutoField) and \
+           _supports_bulk_insert(connection)
+
+    pending = []
+    for obj in objs:
+        if bulk and obj._get_pk_val() is None:
+            pending.append(obj)
+        else:
+            obj.save(force_insert=True, using=using)
+    if not pending:
+        return
+
+    qn = connection.ops.quote_name
+    engine = _engine(connection)
+    batch_size = max(1, min(batch_size, _max_params(connection) / len(fields)))
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    cursor = connection.cursor()
+
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        params = []
+        for obj in batch:
+            params.extend([f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+                           for f in fields])
+        sql = 'INSERT INTO %s (%s) VALUES %s' % (qn(opts.db_table),
+                                                 ', '.join([qn(f.column) for f in fields]),
+                                                 ', '.join([row] * len(batch)))
+        if engine.startswith('postgresql'):
+            cursor.execute(sql + ' RETURNING %s' % qn(opts.pk.column), params)
+            ids = [r[0] for r in cursor.fetchall()]
+        else:
+            #SQLite: the statement holds the write lock of the database, so no
+            #other connection inserts in between, and each row gets the largest
+            #rowid plus one (Django doesn't use AUTOINCREMENT). The ids of the
+            #batch are the consecutive ones that end in the last inserted id.
+            cursor.execute(sql, params)
+            last = cursor.lastrowid
+            ids = range(last - len(batch) + 1, last + 1)
+
+        for obj, id in zip(batch, ids):
+            setattr(obj, opts.pk.attname, id)
+            obj._state.db = using
+            obj._state.adding = False
+
+def _case_value(connection, field):
+    """
+    The placeholder of a THEN value for `field`. PostgreSQL resolves the type of
+    a CASE with untyped parameters to text, so the values are cast to the type
+    of the column. Other databases convert them (and SQLite would turn a date
+    into a number if we cast it to its NUMERIC affinity).
+    """
+    if _engine(connection).startswith('postgresql'):
+        db_type = field.db_type(connection=connection)
+        if db_type:
+            return 'CAST(%%s AS %s)' % db_type
+    return '%s'
+
+def bulk_update(model, objs, fields, batch_size=100, using=None):
+    """
+    Write the value of `fields` (field names) of `objs` (instances of `model`)
+    using one UPDATE statement for every `batch_size` objects::
+
+        UPDATE table SET col = CASE pk WHEN 1 THEN ... WHEN 2 THEN ... END, ...
+        WHERE pk IN (1, 2, ...)
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    opts = model._meta
+    qn = connection.ops.quote_name
+
+    fields = [opts.get_field(name) for name in fields]
+    if not fields or not objs:
+        return
+    pk_column = qn(opts.pk.column)
+    #every object needs (2 * fields + 1) params
+    batch_size = max(1, min(batch_size, _max_params(connection) / (2 * len(fields) + 1)))
+    cursor = connection.cursor()
+
+    for i in range(0, len(objs), batch_size):
+        batch = objs[i:i + batch_size]
+        pks = [opts.pk.get_db_prep_value(obj._get_pk_val(), connection=connection) for obj in batch]
+        assignments = []
+        params = []
+        for field in fields:
+            cases = []
+            case = 'WHEN %%s THEN %s' % _case_value(connection, field)
+            for obj, pk in zip(batch, pks):
+                cases.append(case)
+                params.extend([pk, field.get_db_prep_save(field.pre_save(obj, False),
+                                                          connection=connection)])
+            assignments.append('%s = CASE %s %s END' % (qn(field.column), pk_column, ' '.join(cases)))
+        params.extend(pks)
+        sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (qn(opts.db_table), ', '.join(assignments),
+                                                     pk_column, ', '.join(['%s'] * len(batch)))
+        cursor.execute(sql, params)
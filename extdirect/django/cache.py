@@ -0,0 +1,196 @@
+import time, copy
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+from streaming import RecordStream, RawJSON
+from encoders import dumps
+
+VERSION_KEY = 'extdirect:version:%s.%s'
+METHOD_VERSION_KEY = 'extdirect:version:method:%s.%s'
+ENTRIES_KEY = 'extdirect:entries:method:%s.%s'
+
+#Django cache backends don't agree on what timeout=0 means
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def cache_key(prefix, *parts):
+    """
+    Build a cache key (safe for memcached) from any number of `parts`.
+    """
+    return '%s:%s' % (prefix, md5_constructor(repr(parts)).hexdigest())
+
+def _new_version():
+    #If the version was evicted from the cache, we must not reuse an old one
+    return int(time.time() * 1000)
+
+def _versions(keys):
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), VERSION_TIMEOUT)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), VERSION_TIMEOUT)
+
+def _model_key(model):
+    return VERSION_KEY % (model._meta.app_label, model._meta.object_name)
+
+def model_version(model):
+    """
+    Return the current version of the data of `model`.
+    Everything cached for a model should include its version in the key,
+    so `invalidate_model` invalidates all of them at once.
+    """
+    return _versions([_model_key(model)])[0]
+
+def model_versions(models):
+    """
+    Same as `model_version` for a list of models, using only one cache request.
+    """
+    return _versions([_model_key(model) for model in models])
+
+def invalidate_model(model):
+    _bump(_model_key(model))
+
+def _model_changed(sender, **kwargs):
+    invalidate_model(sender)
+
+def watch_model(model):
+    """
+    Invalidate the version of `model` every time that one of its instances
+    it's saved or deleted (`post_save` and `post_delete` signals).
+    Note that `QuerySet.update()` and the bulk writes don't send these signals,
+    ExtDirectCRUD calls `invalidate_model` itself.
+    """
+    uid = 'extdirect:watch:%s.%s' % (model._meta.app_label, model._meta.object_name)
+    post_save.connect(_model_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(_model_changed, sender=model, dispatch_uid=uid)
+
+def _m2m_changed(sender, instance, action, model, **kwargs):
+    if action.startswith('post_'):
+        invalidate_model(instance.__class__)
+        invalidate_model(model)
+
+def watch_m2m(field):
+    """
+    Invalidate the versions of both models of the ManyToMany `field` every time
+    that the relation changes (`m2m_changed` signal).
+    """
+    through = field.rel.through
+    uid = 'extdirect:watch:m2m:%s.%s' % (through._meta.app_label, through._meta.object_name)
+    m2m_changed.connect(_m2m_changed, sender=through, dispatch_uid=uid)
+
+def related_models(model, exclude=()):
+    """
+    Return `model` and the models of its relations (the ones not in `exclude`),
+    the data of the records built by the `extdirect` serializer.
+    """
+    opts = model._meta
+    return [model] + [f.rel.to for f in opts.fields + opts.many_to_many
+                      if f.rel and f.name not in exclude]
+
+def watch_related(model, exclude=()):
+    """
+    Watch `model`, its related models and its ManyToMany relations
+    (the ones not in `exclude`).
+    """
+    for related in related_models(model, exclude):
+        watch_model(related)
+    for field in model._meta.many_to_many:
+        if field.name not in exclude:
+            watch_m2m(field)
+
+def invalidate_method(action, method):
+    """
+    Drop every response cached for the remoting `method` of `action`.
+    """
+    _bump(METHOD_VERSION_KEY % (action, method))
+    cache.delete(ENTRIES_KEY % (action, method))
+
+def _count_entry(action, method):
+    key = ENTRIES_KEY % (action, method)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, VERSION_TIMEOUT)
+        return cache.incr(key)
+
+class ResponseCache(object):
+    """
+    Cache the results of a remoting method (see ExtRemotingProvider.register).
+
+    The key it's built from the action, the method, the `data` of the call
+    (normalized, so the order of the keys doesn't matter), the version of the
+    method (see `invalidate_method`) and the versions of `models` (see
+    `invalidate_model`, ExtDirectCRUD calls it after every write).
+    If `per_user` it's True, the id of the user it's part of the key too.
+
+    The results are cached (and sent) already encoded as JSON. Failures
+    (`success` False), results bigger than `max_size` bytes and the ones
+    streamed by ExtDirectStore are not cached. When a method has `max_entries`
+    results cached, they are all dropped and it starts again.
+    """
+    def __init__(self, timeout=60, max_size=512 * 1024, max_entries=1000, per_user=False, models=()):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.per_user = per_user
+        self.models = tuple(models)
+
+    def with_models(self, *models):
+        """
+        Return a copy of this cache that depends on `models` too.
+        """
+        clone = copy.copy(self)
+        clone.models = self.models + tuple([m for m in models if m not in self.models])
+        return clone
+
+    def key(self, request, action, method, data):
+        keys = [METHOD_VERSION_KEY % (action, method)] + [_model_key(m) for m in self.models]
+        parts = [action, method, simplejson.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)]
+        parts.extend(_versions(keys))
+        if self.per_user:
+            user = getattr(request, 'user', None)
+            parts.append(user is not None and user.is_authenticated() and user.pk or None)
+        return cache_key('extdirect:response', *parts)
+
+    def call(self, func, request, action, method, data):
+        """
+        Return the cached result of `func(request)` or call it (and cache the result).
+        A cacheable result it's returned encoded (a RawJSON), the router sends it as it's.
+        """
+        key = self.key(request, action, method, data)
+        content = cache.get(key)
+        if content is not None:
+            return RawJSON(content)
+
+        result = func(request)
+        if not self.cacheable(result):
+            return result
+        try:
+            content = dumps(result)
+        except TypeError:
+            return result
+        if len(content) <= self.max_size:
+            if self.max_entries and _count_entry(action, method) > self.max_entries:
+                invalidate_method(action, method)
+            else:
+                cache.set(key, content, self.timeout)
+        return RawJSON(content)
+
+    def cacheable(self, result):
+        if isinstance(result, dict):
+            if result.get('success') is False:
+                return False
+            for value in result.values():
+                if isinstance(value, RecordStream):
+                    return False
+        return True
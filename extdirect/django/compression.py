@@ -0,0 +1,165 @@
+"""
+Compression of the router responses.
+
+Give a `Compression` to ExtRemotingProvider and the responses will be
+compressed with the best encoding accepted by the client (Accept-Encoding)::
+
+    remote_provider = ExtRemotingProvider('django', '/remoting/router/',
+                                          compression=Compression(min_size=1024, level=6))
+
+gzip it's always available, brotli ('br') it's used if the `brotli` module it's
+installed (and the client accepts it). With the default quality (4) brotli it's
+faster than gzip level 6 and the responses are about half the size, see
+benchmarks/compression.py. Responses smaller than `min_size` bytes
+are sent as they are. Streamed responses (see ExtDirectStore `streaming`) are
+compressed while they are sent, whatever their size.
+
+Don't use it if your front server (or GZipMiddleware) already compresses them.
+"""
+import zlib
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+class GzipEncoding(object):
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressor(self):
+        #16 + MAX_WBITS: the gzip header and trailer instead of the zlib ones
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, content):
+        compressor = self.compressor()
+        return compressor.compress(content) + compressor.flush()
+
+    def compress_iter(self, chunks):
+        compressor = self.compressor()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+class BrotliEncoding(object):
+    name = 'br'
+
+    def __init__(self, quality=4):
+        import brotli
+        self.brotli = brotli
+        self.quality = quality
+
+    def compress(self, content):
+        return self.brotli.compress(content, quality=self.quality)
+
+    def compress_iter(self, chunks):
+        compressor = self.brotli.Compressor(quality=self.quality)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+def _bytes(content):
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return content
+
+class CompressedStream(object):
+    """
+    Iterable content for a HttpResponse, compressing the chunks of `content`
+    while they are sent. `close` it's passed on to `content` (e.g. a StreamedResponse).
+    """
+    def __init__(self, content, encoding):
+        self.content = content
+        self.encoding = encoding
+
+    def __iter__(self):
+        return self.encoding.compress_iter(_bytes(chunk) for chunk in self.content)
+
+    def close(self):
+        if hasattr(self.content, 'close'):
+            self.content.close()
+
+def parse_accept_encoding(header):
+    """
+    Return a dict {encoding: q} from an Accept-Encoding header.
+    """
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, sep, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+class Compression(object):
+    """
+    Negotiate and apply the compression of the responses.
+    `level` it's the gzip level (1-9), `brotli_quality` the brotli one (0-11).
+    `encodings` are the names of the encodings that could be used, by preference.
+    """
+    def __init__(self, min_size=1024, level=6, brotli_quality=4, encodings=('br', 'gzip')):
+        self.min_size = min_size
+        self.encodings = []
+        for name in encodings:
+            if name == 'gzip':
+                self.encodings.append(GzipEncoding(level))
+            elif name == 'br':
+                try:
+                    self.encodings.append(BrotliEncoding(brotli_quality))
+                except ImportError:
+                    pass
+            else:
+                raise ValueError('Unknown encoding `%s`' % name)
+
+    def negotiate(self, request):
+        """
+        Return the encoding to use for the response to `request`, or None.
+        """
+        accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        for encoding in self.encodings:
+            q = accepted.get(encoding.name, accepted.get('*', 0))
+            if q > 0:
+                return encoding
+        return None
+
+    def content(self, request, content):
+        """
+        Return (content, encoding name) with the `content` (a string, or an iterable
+        if it's streamed) compressed if the client accepts it and it's worth it.
+        """
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return content, None
+        if isinstance(content, basestring):
+            content = _bytes(content)
+            if len(content) < self.min_size:
+                return content, None
+            return encoding.compress(content), encoding.name
+        return CompressedStream(content, encoding), encoding.name
+
+    def response(self, request, content, mimetype):
+        """
+        Return the HttpResponse for `content`, compressed if possible.
+        """
+        content, encoding = self.content(request, content)
+        response = HttpResponse(content, mimetype=mimetype)
+        #The content depends on the Accept-Encoding even if it wasn't compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding:
+            response['Content-Encoding'] = encoding
+            if isinstance(content, str):
+                response['Content-Length'] = str(len(content))
+        return response
@@ -1,9 +1,12 @@
 from extdirect.django.store import ExtDirectStore
+from extdirect.django.cache import invalidate_model
+from extdirect.django.bulk import bulk_insert, bulk_update as bulk_update_rows
 
 from django.db import transaction
 from django.core.serializers import serialize
 from django.utils.encoding import force_unicode
 from django.views.generic.create_update import get_model_and_form_class
+from django.forms.models import modelform_factory
 
 def format_form_errors(errors):
     """
@@ -34,6 +37,17 @@ class BaseExtDirectCRUD(object):
     show_form_validation = False 
     metadata = True   
     
+    #Bulk mode, see `extdirect.django.bulk`.
+    bulk_create = False
+    bulk_update = False
+    bulk_destroy = False
+    bulk_batch_size = 100
+    
+    #ResponseCache for `read` and `load` (see `extdirect.django.cache`).
+    #The cached results depend on `model`, so they are invalidated after
+    #every create, update or destroy.
+    cache = None
+    
     #Messages
     create_success_msg = "Records created"
     create_failure_msg = "There was an error while trying to save some of the records"
@@ -75,10 +89,12 @@ class BaseExtDirectCRUD(object):
         provider.register(self.create, action, 'create', 1, self.isForm, login_required, permission)
         
     def reg_read(self, provider, action, login_required, permission):        
-        provider.register(self.read, action, 'read', 1, False, login_required, permission)
+        provider.register(self.read, action, 'read', 1, False, login_required, permission,
+                          cache=self._response_cache())
         
     def reg_load(self, provider, action, login_required, permission):        
-        provider.register(self.load, action, 'load', 1, False, login_required, permission)        
+        provider.register(self.load, action, 'load', 1, False, login_required, permission,
+                          cache=self._response_cache())
         
     def reg_update(self, provider, action, login_required, permission):
         provider.register(self.update, action, 'update', 1, self.isForm, login_required, permission)
@@ -86,6 +102,11 @@ class BaseExtDirectCRUD(object):
     def reg_destroy(self, provider, action, login_required, permission):
         provider.register(self.destroy, action, 'destroy', 1, False, login_required, permission)
     
+    def _response_cache(self):
+        if self.cache:
+            return self.cache.with_models(self.model)
+        return None
+    
     def direct_store(self):
         return ExtDirectStore(self.model, metadata=self.metadata)
         
@@ -139,7 +160,109 @@ class BaseExtDirectCRUD(object):
             return c.id, ""
         else:
             return 0, form.errors            
+    
+    def _bulk_create(self, request, records):
+        #Validate all the records first. If everything it's ok, we insert
+        #them in batches. It returns the objects created and the list of
+        #errors for each record.
+        forms = []
+        errors = []
+        for data in records:
+            data.pop("id", "")
+            if self.parse_fk_fields:
+                data = self._fk_fields_parser(data)
+            
+            form = self.form(data, request.FILES)
+            forms.append(form)
+            if form.is_valid():
+                errors.append({})
+            else:
+                errors.append(form.errors)
+        
+        if filter(None, errors):
+            return [], errors
+            
+        objs = [form.save(commit=False) for form in forms]
+        bulk_insert(self.model, objs, self.bulk_batch_size)
+        for form, obj in zip(forms, objs):
+            form.save_m2m()
+            self.post_single_create(request, obj)
+        
+        return objs, errors
+    
+    def _changed_fields_form(self, fields):
+        #A form class with only the fields that the client sent
+        key = tuple(sorted(fields))
+        cache = self.__dict__.setdefault('_changed_forms', {})
+        if key not in cache:
+            cache[key] = modelform_factory(self.model, form=self.form, fields=list(key))
+        return cache[key]
+    
+    def _bulk_update(self, request, records):
+        #Read all the objects with a single query, validate only the fields
+        #sent for each record and write them grouped by the set of changed fields.
+        #It returns the objects updated and the list of errors for each record.
+        pk = self.model._meta.pk
+        related = [f.name for f in self.model._meta.fields if f.rel]
+        ids = [pk.to_python(data["id"]) for data in records]
+        instances = self.model.objects.select_related(*related).in_bulk(ids)
+        
+        forms = []
+        errors = []
+        groups = {}
+        opts = self.model._meta
+        columns = set([f.name for f in opts.fields])
+        auto_now = [f.name for f in opts.fields if getattr(f, 'auto_now', False)]
+        for id, data in zip(ids, records):
+            data.pop("id")
+            if id not in instances:
+                raise self.model.DoesNotExist("%s matching query does not exist." % opts.object_name)
+            
+            if self.parse_fk_fields:
+                data = self._fk_fields_parser(data)
+            fields = [f for f in data.keys() if f in self.form.base_fields]
+            if not fields:
+                #Nothing to change (e.g. only `extras` were sent). An empty `fields`
+                #would be a form with all the fields, so there isn't a form for it.
+                errors.append({})
+                continue
+            
+            form = self._changed_fields_form(fields)(data, request.FILES, instance=instances[id])
+            forms.append(form)
+            if form.is_valid():
+                #ManyToMany fields are saved by the form (save_m2m)
+                changed = set([f for f in fields if f in columns] + auto_now)
+                groups.setdefault(tuple(sorted(changed)), []).append(form.instance)
+                errors.append({})
+            else:
+                errors.append(form.errors)
+        
+        if filter(None, errors):
+            return [], errors
+        
+        for form in forms:
+            form.save(commit=False)
+        for changed, group in groups.items():
+            bulk_update_rows(self.model, group, changed, self.bulk_batch_size)
+        for form in forms:
+            form.save_m2m()
+            self.post_single_update(request, form.instance)
+        
+        #The forms changed the instances, the unchanged ones are returned as they are
+        objs = [instances[id] for id in ids]
+            
+        return objs, errors
            
+    @transaction.commit_on_success
+    def _bulk_destroy(self, request, ids):
+        #The objects (and the related ones) are collected and deleted
+        #by QuerySet.delete() in one pass, inside a transaction.
+        #It returns the ids deleted.
+        queryset = self.model.objects.filter(pk__in=ids)
+        deleted = list(queryset.values_list('pk', flat=True))
+        queryset.delete()
+        return deleted
+    
     def _single_update(self, request, data):
         id = data.pop("id")        
         obj = self.model.objects.get(pk=id)        
@@ -197,6 +320,11 @@ class BaseExtDirectCRUD(object):
     def post_destroy(self, id):
         pass
     
+    def post_bulk_destroy(self, ids):
+        #Called once with all the ids deleted in bulk mode.
+        for id in ids:
+            self.post_destroy(id)
+    
     def failure(self, msg):
         return {self.store.success: False, self.store.root: [], self.store.total: 0, self.store.message: msg}
             
@@ -220,6 +348,9 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
         ok, msg = self.pre_create(extdirect_data)
         if not ok:
             return self.failure(msg)
+        
+        if self.bulk_create and isinstance(extdirect_data, list):
+            return self.create_bulk(request, sid, extdirect_data)
                     
         ids = []
         success = True
@@ -241,8 +372,9 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
             
         if success:
             transaction.commit()    
+            invalidate_model(self.model)
             self.post_create(ids)
-            res = self.store.query(self.model.objects.filter(pk__in=ids), metadata=False)            
+            res = self.store.query(self.model.objects.filter(pk__in=ids), metadata=False, cached=False)            
             res[self.store.message] = self.create_success_msg
             return res
         else:
@@ -254,6 +386,27 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
                 
             return self.failure(err)
         
+    def create_bulk(self, request, sid, records):
+        objs, errors = self._bulk_create(request, records)
+        
+        if objs or not records:
+            transaction.commit()
+            invalidate_model(self.model)
+            self.post_create([obj.pk for obj in objs])
+            #We already have the objects, no need to read them again
+            res = self.store.serialize(objs, metadata=False, total=len(objs))
+            res[self.store.message] = self.create_success_msg
+            return res
+        else:
+            transaction.savepoint_rollback(sid)
+            if self.show_form_validation:
+                #One (maybe empty) dict of errors for each record
+                err = [format_form_errors(e) for e in errors]
+            else:
+                err = self.create_failure_msg
+                
+            return self.failure(err)
+        
     #READ        
     def read(self, request):
         extdirect_data = self.extract_read_data(request)
@@ -292,6 +445,9 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
         if not ok:
             return self.failure(msg)
         
+        if self.bulk_update and isinstance(extdirect_data, list):
+            return self.update_bulk(request, sid, extdirect_data)
+        
         ids = []
         success = True
         records = extdirect_data                
@@ -316,8 +472,9 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
 
         if success:
             transaction.commit()    
+            invalidate_model(self.model)
             self.post_update(ids)
-            res = self.store.query(self.model.objects.filter(pk__in=ids), metadata=False)
+            res = self.store.query(self.model.objects.filter(pk__in=ids), metadata=False, cached=False)
             res[self.store.message] = self.update_success_msg
             return res
         else:
@@ -329,6 +486,27 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
                 
             return self.failure(err)
     
+    def update_bulk(self, request, sid, records):
+        objs, errors = self._bulk_update(request, records)
+        
+        if objs or not records:
+            transaction.commit()
+            invalidate_model(self.model)
+            self.post_update([obj.pk for obj in objs])
+            #We already have the objects, no need to read them again
+            res = self.store.serialize(objs, metadata=False, total=len(objs))
+            res[self.store.message] = self.update_success_msg
+            return res
+        else:
+            transaction.savepoint_rollback(sid)
+            if self.show_form_validation:
+                #One (maybe empty) dict of errors for each record
+                err = [format_form_errors(e) for e in errors]
+            else:
+                err = self.update_failure_msg
+                
+            return self.failure(err)
+    
     #DESTROY        
     def destroy(self, request):        
         ids = self.extract_destroy_data(request)
@@ -337,6 +515,9 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
         if not ok:
             return self.failure(msg)
         
+        if self.bulk_destroy:
+            return self.destroy_bulk(request, ids)
+        
         if isinstance(ids, list):
             cs = self.model.objects.filter(pk__in=ids)
         else:            
@@ -348,6 +529,19 @@ class ExtDirectCRUD(BaseExtDirectCRUD):
                 
             self.post_destroy(i)
         
+        invalidate_model(self.model)
+        return {self.store.success: True,
+                self.store.message: self.destroy_success_msg,
+                self.store.root: []}
+    
+    def destroy_bulk(self, request, ids):
+        if not isinstance(ids, list):
+            ids = [ids]
+        deleted = self._bulk_destroy(request, ids)
+        
+        self.post_bulk_destroy(deleted)
+        
+        invalidate_model(self.model)
         return {self.store.success: True,
                 self.store.message: self.destroy_success_msg,
                 self.store.root: []}
@@ -1,24 +1,29 @@
 from crud import ExtDirectCRUD
 
 def remoting(provider, action=None, name=None, len=0, form_handler=False, \
-             login_required=False, permission=None):
+             login_required=False, permission=None, concurrent=True, cache=None):
     """
     Decorator to register a function for a given `action` and `provider`.
     `provider` must be an instance of ExtRemotingProvider
     """    
     def decorator(func):        
-        provider.register(func, action, name, len, form_handler, login_required, permission)
+        provider.register(func, action, name, len, form_handler, login_required, permission,
+                          concurrent=concurrent, cache=cache)
         return func
         
     return decorator
 
-def polling(provider, login_required=False, permission=None):
+def polling(provider, login_required=False, permission=None, event=None, version=None):
     """
     Decorator to register a function for a `provider`.
-    `provider` must be an instance of ExtPollingProvider
+    `provider` must be an instance of ExtPollingProvider, `event` and `version`
+    are only used by ExtMultiPollingProvider.
     """
     def decorator(func):
-        provider.register(func, login_required, permission)
+        if event is None and version is None:
+            provider.register(func, login_required, permission)
+        else:
+            provider.register(func, login_required, permission, event=event, version=version)
         return func
     
     return decorator
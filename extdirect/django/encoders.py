@@ -0,0 +1,106 @@
+"""
+JSON encoders for the Ext.Direct responses.
+
+Use the EXTDIRECT_JSON_ENCODER setting to choose one:
+
+ - 'auto' (the default): the fastest library installed, cjson or simplejson
+   (the one in django.utils).
+ - 'cjson' or 'simplejson'.
+ - The dotted path of a class with an `encode(obj)` method.
+
+The C libraries don't call a `default` function for dates and Decimals,
+so when they fail we encode the same object using simplejson and
+DjangoJSONEncoder. The records built by the `extdirect` serializer have
+the dates and Decimals already converted (see `serializer.json_converter`),
+so that should only happen with the results of your own methods.
+
+ujson it's not supported: 1.x encodes dates as timestamps and Decimals as
+floats without complaining (DjangoJSONEncoder gives strings), and 2.x doesn't
+run on Python 2.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.importlib import import_module
+
+class SimplejsonEncoder(DjangoJSONEncoder):
+    """
+    Same as DjangoJSONEncoder, the C speedups are used when available.
+    """
+    name = 'simplejson'
+
+class FallbackEncoder(object):
+    """
+    Base class for the encoders of the C libraries.
+    """
+    errors = (TypeError, ValueError, OverflowError)
+
+    def __init__(self):
+        self.fallback = SimplejsonEncoder()
+
+    def encode(self, obj):
+        try:
+            return self.dumps(obj)
+        except self.errors:
+            return self.fallback.encode(obj)
+
+class CjsonEncoder(FallbackEncoder):
+    name = 'cjson'
+
+    def __init__(self):
+        super(CjsonEncoder, self).__init__()
+        import cjson
+        self.cjson = cjson
+        self.errors = FallbackEncoder.errors + (cjson.EncodeError,)
+
+    def dumps(self, obj):
+        return self.cjson.encode(obj)
+
+ENCODERS = {
+    'cjson': CjsonEncoder,
+    'simplejson': SimplejsonEncoder
+}
+
+#The order used by 'auto'
+PREFERRED = ('cjson', 'simplejson')
+
+_encoder = None
+
+def load_encoder(name):
+    """
+    Return an instance of the encoder `name` (see above). If `name` it's 'auto'
+    we use the first library that it's installed.
+    """
+    if name == 'auto':
+        for name in PREFERRED:
+            try:
+                return ENCODERS[name]()
+            except ImportError:
+                pass
+    if name in ENCODERS:
+        return ENCODERS[name]()
+
+    try:
+        module, attr = name.rsplit('.', 1)
+        return getattr(import_module(module), attr)()
+    except (ValueError, ImportError, AttributeError), e:
+        raise ImproperlyConfigured('Error loading the JSON encoder %s: "%s"' % (name, e))
+
+def get_encoder():
+    """
+    Return the encoder given by the EXTDIRECT_JSON_ENCODER setting.
+    """
+    global _encoder
+    if _encoder is None:
+        _encoder = load_encoder(getattr(settings, 'EXTDIRECT_JSON_ENCODER', 'auto'))
+    return _encoder
+
+def reset_encoder():
+    """
+    Load the encoder again the next time, e.g. after the setting was changed.
+    """
+    global _encoder
+    _encoder = None
+
+def dumps(obj):
+    return get_encoder().encode(obj)
@@ -0,0 +1,191 @@
+"""
+Translation of the Ext filters and sorters to ORM lookups.
+
+ExtDirectStore understands the `filter` and `sort` arrays sent by the stores
+with remoteFilter/remoteSort::
+
+    filter: [{"property": "age", "operator": "gt", "value": 18}, ...]
+    sort: [{"property": "name", "direction": "ASC"}, ...]
+
+(they could be sent encoded as JSON strings too). The filters of the Ext 3
+GridFilters plugin ({"field": ..., "data": {"comparison": ..., "value": ...}})
+work as well.
+
+Only the fields in the whitelist of the store could be used, by default the
+fields of the model that the client gets (with their `mappings` names).
+"""
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db.models.fields import FieldDoesNotExist
+from django.utils import simplejson
+
+#Ext operator --> (lookup, negated)
+OPERATORS = {
+    'eq': ('exact', False),
+    '=': ('exact', False),
+    '==': ('exact', False),
+    'ne': ('exact', True),
+    '!=': ('exact', True),
+    'lt': ('lt', False),
+    '<': ('lt', False),
+    'lte': ('lte', False),
+    'le': ('lte', False),
+    '<=': ('lte', False),
+    'gt': ('gt', False),
+    '>': ('gt', False),
+    'gte': ('gte', False),
+    'ge': ('gte', False),
+    '>=': ('gte', False),
+    'like': ('icontains', False),
+    'in': ('in', False),
+}
+
+#What to do with a sort on a column without index
+UNINDEXED_SORT = ('allow', 'flag', 'refuse')
+
+logger = logging.getLogger('extdirect')
+
+class QueryError(ValueError):
+    """
+    The filters or sorters of the client can't be used.
+    """
+
+def decode_list(value):
+    """
+    Return the list of dicts in `value` (maybe encoded as JSON) or None.
+    """
+    if isinstance(value, basestring):
+        if not value.lstrip().startswith('['):
+            return None
+        try:
+            value = simplejson.loads(value)
+        except ValueError:
+            return None
+    if isinstance(value, (list, tuple)) and all(isinstance(item, dict) for item in value):
+        return list(value)
+    return None
+
+def model_fields(model, mappings={}, exclude=[]):
+    """
+    Return the default whitelist {client name: ORM path} for `model`,
+    the same fields sent to the client (ForeignKeys by their name and their `_id`).
+    """
+    fields = {}
+    for field in model._meta.fields:
+        if field.name in exclude:
+            continue
+        if field.rel is None:
+            fields[mappings.get(field.name, field.name)] = field.name
+        else:
+            fields[field.name] = field.name
+            fields[field.name + '_id'] = field.name
+    return fields
+
+def is_indexed(model, path):
+    """
+    True if the column of the ORM `path` has an index (the primary key,
+    unique fields, `db_index` and ForeignKeys, the first field of
+    `unique_together`).
+    """
+    names = path.split('__')
+    for name in names[:-1]:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if field.rel is None:
+            return False
+        model = field.rel.to
+    name = names[-1]
+    if name == 'pk':
+        return True
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    if field.primary_key or field.unique or field.db_index:
+        return True
+    for together in model._meta.unique_together:
+        if together and together[0] == name:
+            return True
+    return False
+
+class QueryTranslator(object):
+    """
+    Translate the filters and sorters of the client for `model`.
+    `fields` it's the whitelist {client name: ORM path}.
+    """
+    def __init__(self, model, fields, unindexed_sort='allow'):
+        if unindexed_sort not in UNINDEXED_SORT:
+            raise ValueError('`unindexed_sort` must be one of %s' % ', '.join(UNINDEXED_SORT))
+        self.model = model
+        self.fields = fields
+        self.unindexed_sort = unindexed_sort
+
+    def path(self, name):
+        """
+        Return the ORM path of the field `name` of the client.
+        """
+        try:
+            return self.fields[name]
+        except (KeyError, TypeError):
+            raise QueryError('Unknown field `%s`' % name)
+
+    def filter(self, queryset, filters):
+        """
+        Apply the `filters` (a list of dicts) to `queryset`.
+        """
+        for item in filters:
+            data = item.get('data')
+            if isinstance(data, dict):
+                #Ext 3 GridFilters
+                name, operator, value = item.get('field'), data.get('comparison', 'eq'), data.get('value')
+            else:
+                name, operator, value = item.get('property'), item.get('operator', 'eq'), item.get('value')
+
+            path = self.path(name)
+            try:
+                lookup, negated = OPERATORS[operator]
+            except (KeyError, TypeError):
+                raise QueryError('Unknown operator `%s`' % operator)
+            if lookup == 'in' and not isinstance(value, (list, tuple)):
+                raise QueryError('The `in` operator needs a list of values')
+
+            condition = {'%s__%s' % (path, lookup): value}
+            try:
+                if negated:
+                    queryset = queryset.exclude(**condition)
+                else:
+                    queryset = queryset.filter(**condition)
+            except (ValueError, TypeError, ValidationError):
+                #e.g. a date field raises ValidationError
+                raise QueryError('Invalid value for `%s`' % name)
+        return queryset
+
+    def order_by(self, sorters):
+        """
+        Return the arguments of `order_by` for the `sorters` (a list of dicts).
+        """
+        keys = []
+        for item in sorters:
+            path = self.path(item.get('property'))
+            direction = str(item.get('direction', 'ASC')).upper()
+            if direction not in ('ASC', 'DESC'):
+                raise QueryError('Unknown direction `%s`' % direction)
+            keys.append(direction == 'DESC' and '-' + path or path)
+        if keys:
+            self.check_sort(keys[0].lstrip('-'))
+        return keys
+
+    def check_sort(self, path):
+        """
+        Apply the `unindexed_sort` policy to a sort by `path`. Only the first
+        sort key it's checked, it's the one that needs an index.
+        """
+        if self.unindexed_sort == 'allow' or is_indexed(self.model, path):
+            return
+        message = 'Sorting %s by `%s`, a column without index' % (self.model._meta.object_name, path)
+        if self.unindexed_sort == 'refuse':
+            raise QueryError(message)
+        logger.warning(message)
@@ -0,0 +1,250 @@
+"""
+Per-call instrumentation for ExtRemotingProvider.
+
+Give an `Instrumentation` to the provider and every call will be measured:
+wall time, number and time of the DB queries, size of the encoded result
+and the exception raised (if any). The measures (a `Call`) are sent to
+each one of the sinks::
+
+    stats = StatsSink()
+    instrumentation = Instrumentation(LoggingSink(), stats, StatsdSink('localhost', 8125))
+    remote_provider = ExtRemotingProvider('django', '/remoting/router/',
+                                          instrumentation=instrumentation)
+
+    urlpatterns = patterns('',
+        (r'^remoting/stats/$', stats.view),
+        ...
+    )
+"""
+import time, math, logging, socket, threading
+
+from django.db import connections
+from django.http import HttpResponse
+from django.utils import simplejson
+from django.core.serializers.json import DjangoJSONEncoder
+
+from streaming import RawJSON, is_streamed
+
+class _CountingCursor(object):
+    """
+    Cursor wrapper that adds the number and time of the queries to a Call.
+    """
+    def __init__(self, cursor, call):
+        self.cursor = cursor
+        self.call = call
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.call.queries += 1
+            self.call.query_time += time.time() - start
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.call.queries += 1
+            self.call.query_time += time.time() - start
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+class Call(object):
+    """
+    The measures of a single call. Times are in seconds, `size` it's in bytes
+    (None when the result it's streamed) and `exception` it's the name of the
+    exception class (None if the call didn't fail).
+    """
+    def __init__(self, action, method):
+        self.action = action
+        self.method = method
+        self.time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.size = None
+        self.exception = None
+
+    def start(self):
+        #The connections are thread-local objects, so setting `cursor` on them
+        #only wraps the cursors of the current thread.
+        self._wrapped = []
+        for conn in connections.all():
+            self._wrapped.append((conn, conn.__dict__.get('cursor')))
+            conn.cursor = self._cursor_factory(conn.cursor)
+        self._start = time.time()
+
+    def _cursor_factory(self, cursor):
+        def factory():
+            return _CountingCursor(cursor(), self)
+        return factory
+
+    def stop(self):
+        self.time = time.time() - self._start
+        for conn, previous in self._wrapped:
+            if previous is None:
+                del conn.cursor
+            else:
+                conn.cursor = previous
+        self._wrapped = []
+
+    def encode(self, result, encoder):
+        """
+        Encode the `result` (so we know its size) unless it's streamed.
+        """
+        if isinstance(result, RawJSON):
+            self.size = len(result.content)
+            return result
+        if is_streamed({'result': result}):
+            return result
+        result = RawJSON(encoder.encode(result))
+        self.size = len(result.content)
+        return result
+
+class Instrumentation(object):
+    """
+    Measure every call and send the measures to `sinks`.
+    """
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+
+    def start(self, action, method):
+        call = Call(action, method)
+        call.start()
+        return call
+
+    def finish(self, call):
+        call.stop()
+        for sink in self.sinks:
+            sink.emit(call)
+
+class LoggingSink(object):
+    """
+    Log every call (INFO, or WARNING if it failed) to `logger`.
+    """
+    def __init__(self, logger='extdirect'):
+        self.logger = logging.getLogger(logger)
+
+    def emit(self, call):
+        level = call.exception and logging.WARNING or logging.INFO
+        self.logger.log(level, '%s.%s %.1fms, %d queries (%.1fms), %s bytes%s',
+                        call.action, call.method, call.time * 1000, call.queries,
+                        call.query_time * 1000, call.size is None and '?' or call.size,
+                        call.exception and ', raised %s' % call.exception or '')
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of the sorted list `values`.
+    """
+    if not values:
+        return None
+    index = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+class StatsSink(object):
+    """
+    Aggregate the calls in memory, by action and method. It keeps the wall time
+    of the last `samples` calls of each method to get the percentiles.
+    Use `view` to expose the stats (as JSON) in your urls.py (and protect it
+    as you would do with any admin page).
+    """
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.methods = {}
+        finally:
+            self.lock.release()
+
+    def emit(self, call):
+        self.lock.acquire()
+        try:
+            key = '%s.%s' % (call.action, call.method)
+            stats = self.methods.get(key)
+            if stats is None:
+                stats = self.methods[key] = dict(calls=0, errors=0, queries=0, query_time=0.0,
+                                                 size=0, times=[])
+            stats['calls'] += 1
+            stats['queries'] += call.queries
+            stats['query_time'] += call.query_time
+            stats['size'] += call.size or 0
+            if call.exception:
+                stats['errors'] += 1
+            times = stats['times']
+            if len(times) == self.samples:
+                times[stats['calls'] % self.samples] = call.time
+            else:
+                times.append(call.time)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Return a dict {'action.method': stats} where the times are in milliseconds.
+        """
+        self.lock.acquire()
+        try:
+            result = {}
+            for key, stats in self.methods.items():
+                times = sorted(stats['times'])
+                calls = stats['calls']
+                result[key] = {
+                    'calls': calls,
+                    'errors': stats['errors'],
+                    'queries': float(stats['queries']) / calls,
+                    'query_time': stats['query_time'] * 1000 / calls,
+                    'size': float(stats['size']) / calls,
+                    'p50': percentile(times, 50) * 1000,
+                    'p90': percentile(times, 90) * 1000,
+                    'p99': percentile(times, 99) * 1000,
+                    'max': times[-1] * 1000
+                }
+            return result
+        finally:
+            self.lock.release()
+
+    def view(self, request):
+        return HttpResponse(simplejson.dumps(self.stats(), cls=DjangoJSONEncoder),
+                            mimetype='application/json')
+
+class StatsdSink(object):
+    """
+    Send the measures of every call to a StatsD server (UDP), in one packet::
+
+        <prefix>.<action>.<method>.calls:1|c
+        <prefix>.<action>.<method>.time:12.3|ms
+        <prefix>.<action>.<method>.queries:3|c
+        <prefix>.<action>.<method>.query_time:4.5|ms
+        <prefix>.<action>.<method>.size:1024|c
+        <prefix>.<action>.<method>.errors:1|c    (only if it failed)
+
+    Network errors are ignored, the instrumentation must not break the calls.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='extdirect'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, call):
+        name = '%s.%s.%s' % (self.prefix, call.action, call.method)
+        lines = ['%s.calls:1|c' % name,
+                 '%s.time:%.3f|ms' % (name, call.time * 1000),
+                 '%s.queries:%d|c' % (name, call.queries),
+                 '%s.query_time:%.3f|ms' % (name, call.query_time * 1000)]
+        if call.size is not None:
+            lines.append('%s.size:%d|c' % (name, call.size))
+        if call.exception:
+            lines.append('%s.errors:1|c' % name)
+        try:
+            self.socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except socket.error:
+            pass
@@ -26,12 +26,33 @@ DJANGO_EXT_MAP = {
     #'ManyToMany'                   : ????
 }
 
+#The fields generated by `meta_fields`, by model, mappings and exclude
+_meta_fields_cache = {}
+
 def meta_fields(model, mappings={}, exclude=[], get_metadata=None):
     """
     Generate metadata for a given Django model.
     You could provide the `get_metadata` function to generate
     custom metadata for some fields.
+    
+    The result it's memoized (unless you give `get_metadata`, it could be a new
+    function every time), every store of the same model shares it
+    (you get a copy of each field config, so you could change them).
     """
+    if get_metadata is not None:
+        return _meta_fields(model, mappings, exclude, get_metadata)
+    
+    try:
+        key = (model, tuple(sorted(mappings.items())), tuple(exclude))
+        hash(key)
+    except TypeError:
+        return _meta_fields(model, mappings, exclude, get_metadata)
+    
+    if key not in _meta_fields_cache:
+        _meta_fields_cache[key] = _meta_fields(model, mappings, exclude, get_metadata)
+    return [config.copy() for config in _meta_fields_cache[key]]
+
+def _meta_fields(model, mappings, exclude, get_metadata):
     fields = [f for f in model._meta.fields if f.name not in exclude]
     result = []
     for field in fields:
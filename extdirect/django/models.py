@@ -13,6 +13,9 @@ class FKModel(models.Model):
 class Model(models.Model):
     fk_model = models.ForeignKey(FKModel, verbose_name="fk")
 
+class M2MModel(models.Model):
+    fk_models = models.ManyToManyField(FKModel)
+
 class ExtDirectStoreModel(models.Model):
     #We use this class only for testing purpose
     name = models.CharField(verbose_name="name", max_length=35)
@@ -0,0 +1,75 @@
+"""
+Authentication state and permissions of the user, resolved once per request.
+
+The router of ExtRemotingProvider creates an AuthContext for every request
+(`request.extdirect_auth`) and checks all the permissions needed by the calls
+of a batch at once, using the `permission_backend` of the provider.
+A permission backend implements `has_perms(user, perms)` and returns a dict
+{perm: True/False}.
+"""
+from django.db.models import Q
+
+class UserPermissionBackend(object):
+    """
+    Ask `user.has_perm` for each permission (the default).
+    This works with any of the AUTHENTICATION_BACKENDS.
+    """
+    def has_perms(self, user, perms):
+        return dict([(perm, user.has_perm(perm)) for perm in perms])
+
+class QueryPermissionBackend(object):
+    """
+    Check all the permissions with a single query on the permissions of the
+    user and their groups. It's the same that django.contrib.auth ModelBackend
+    does, don't use it with other authentication backends (e.g. object permissions).
+    """
+    def has_perms(self, user, perms):
+        if not user.is_active:
+            return dict([(perm, False) for perm in perms])
+        if user.is_superuser:
+            return dict([(perm, True) for perm in perms])
+
+        from django.contrib.auth.models import Permission
+        codenames = set([perm.split('.', 1)[-1] for perm in perms])
+        granted = Permission.objects.filter(codename__in=codenames) \
+                                    .filter(Q(user=user) | Q(group__user=user)) \
+                                    .values_list('content_type__app_label', 'codename')
+        granted = set(['%s.%s' % row for row in granted])
+        return dict([(perm, perm in granted) for perm in perms])
+
+class AuthContext(object):
+    """
+    Memoize `is_authenticated` and the permissions of `user`.
+    """
+    def __init__(self, user, backend=None):
+        self.user = user
+        self.backend = backend or UserPermissionBackend()
+        self._authenticated = None
+        self._perms = {}
+
+    def is_authenticated(self):
+        if self._authenticated is None:
+            self._authenticated = self.user.is_authenticated()
+        return self._authenticated
+
+    def has_perm(self, perm):
+        if perm not in self._perms:
+            self.prefetch([perm])
+        return self._perms[perm]
+
+    def prefetch(self, perms):
+        """
+        Check all the `perms` that weren't checked yet in one backend call.
+        """
+        missing = [perm for perm in set(perms) if perm not in self._perms]
+        if missing:
+            self._perms.update(self.backend.has_perms(self.user, missing))
+
+def get_auth(request, backend=None):
+    """
+    Return the AuthContext of the `request` (created if needed).
+    """
+    auth = getattr(request, 'extdirect_auth', None)
+    if auth is None:
+        auth = request.extdirect_auth = AuthContext(request.user, backend)
+    return auth
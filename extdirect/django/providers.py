@@ -1,9 +1,18 @@
-import sys, traceback
+import sys, traceback, copy, threading, re
+from Queue import Queue
 
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.utils import simplejson
-from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.http import condition
+
+from streaming import StreamedResponse, is_streamed, prefetch
+from cache import invalidate_method
+from encoders import get_encoder
+from permissions import AuthContext, get_auth
 from django.conf import settings
+from django.db import connections
 
 SCRIPT = """
 Ext.onReady(function() {
@@ -11,15 +20,152 @@ Ext.onReady(function() {
 });    
 """
 
+#Default max size (in bytes) of a JSON request
+MAX_REQUEST_SIZE = 10 * 1024 * 1024
+
+#How much of a request bigger than the max size we read to answer it
+#with its `tid`, `action` and `method`
+CALL_IDS_SIZE = 64 * 1024
+
+def _str_keys(pairs):
+    #Convert the keys to strings instead of unicodes {u'key': u'value'} --> {'key': u'value'}.
+    #This is needed if the function called want to pass the dictionaries as kw arguments.
+    obj = {}
+    for key, value in pairs:
+        try:
+            obj[str(key)] = value
+        except UnicodeEncodeError:
+            #not a valid kw argument anyway
+            obj[key] = value
+    return obj
+
+try:
+    simplejson.loads('{}', object_pairs_hook=_str_keys)
+    _hook = dict(object_pairs_hook=_str_keys)
+except TypeError:
+    #simplejson < 2.1 and Python < 2.7
+    _hook = dict(object_hook=lambda obj: _str_keys(obj.iteritems()))
+
+def parse_json(content):
+    """
+    Decode an Ext.Direct request. The keys of every object are strings
+    (if they are ASCII), converted while the request it's decoded.
+    """
+    return simplejson.loads(content, **_hook)
+
+def _content_length(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except (ValueError, TypeError):
+        return 0
+
+def read_body(request, limit):
+    """
+    Return (body, too_large) for the JSON `request`. We never read more than
+    `limit` + 1 bytes, whatever the Content-Length says (a chunked request
+    doesn't have it). If the Content-Length it's already too large we only
+    read the first CALL_IDS_SIZE bytes, see `call_ids`.
+    """
+    environ = getattr(request, 'environ', {})
+    if limit is None or hasattr(request, '_raw_post_data') or 'wsgi.input' not in environ:
+        #Already read (or not a WSGI request), Django reads it
+        body = request.raw_post_data
+        return body, limit is not None and len(body) > limit
+    
+    length = _content_length(request)
+    if not length and not environ.get('wsgi.input_terminated'):
+        #As Django does, without a Content-Length there isn't a body
+        return request.raw_post_data, False
+    if length > limit:
+        size = min(length, CALL_IDS_SIZE)
+    else:
+        size = length or limit + 1
+    
+    stream = environ['wsgi.input']
+    chunks = []
+    read = 0
+    while read < size:
+        chunk = stream.read(min(64 * 1024, size - read))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        read += len(chunk)
+    body = ''.join(chunks)
+    if length > limit or len(body) > limit:
+        return body, True
+    #Django reads the body only once, it's kept for request.POST and the like
+    request._raw_post_data = body
+    return body, False
+
+_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]:]|-?\d+')
+
+def call_ids(head):
+    """
+    Return the `tid`, `action` and `method` of a single call found in `head`
+    (the beginning of the JSON request, maybe truncated) as a dict.
+    Only the keys of the call itself are used, not the ones inside `data`.
+    """
+    ids = {}
+    if not head.lstrip().startswith('{'):
+        return ids
+    tokens = _TOKENS.findall(head)
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+        elif depth == 1 and token[1:-1] in ('tid', 'action', 'method') and \
+             tokens[i + 1:i + 2] == [':'] and i + 2 < len(tokens):
+            try:
+                ids[token[1:-1]] = simplejson.loads(tokens[i + 2])
+            except ValueError:
+                pass
+    return ids
+
 class ExtDirectProvider(object):
     """
     Abstract class for different ExtDirect Providers implementations
     """
     
+    #Cache-Control max-age (in seconds) for the `script` and `api` responses
+    max_age = 3600
+    
     def __init__(self, url, type, id=None):        
         self.type = type        
         self.url = url
         self.id = id
+        
+        self._invalidate()
+    
+    def _invalidate(self):
+        """
+        Drop the serialized descriptors. Subclasses must call this method
+        every time that the `_config` changes.
+        """
+        self._descriptors = {}
+        
+    def _descriptor_response(self, request, key, build, mimetype):
+        """
+        Return a HttpResponse with the descriptor identified by `key`.
+        The content it's built (calling `build`) only once until the next `_invalidate`,
+        and it's served with an ETag so clients could revalidate it. There is no
+        Last-Modified, every process of the server would give a different one.
+        """
+        try:
+            content, etag = self._descriptors[key]
+        except KeyError:
+            content = build()
+            etag = md5_constructor(content).hexdigest()
+            self._descriptors[key] = (content, etag)
+            
+        @condition(etag_func=lambda request: etag)
+        def view(request):
+            response = HttpResponse(content, mimetype=mimetype)
+            patch_cache_control(response, public=True, max_age=self.max_age)
+            return response
+        
+        return view(request)
     
     @property
     def _config(self):
@@ -69,11 +215,76 @@ class ExtDirectProvider(object):
                 ...
             )
         """
-        config = simplejson.dumps(self._config)
-        js =  SCRIPT % config
-                
-        return HttpResponse(js, mimetype='text/javascript')
+        return self._descriptor_response(request, 'script',
+                                         lambda: SCRIPT % simplejson.dumps(self._config),
+                                         'text/javascript')
+    
+#Parameters of a Form POST that aren't part of the form
+FORM_PARAMS = ('extAction', 'extMethod', 'extTID', 'extType', 'extUpload')
+
+class RemotingMethod(dict):
+    """
+    A method registered in an ExtRemotingProvider, compiled by `register`.
+    
+    It's still the dict with the registration info (`func`, `len`, `form_handler`,
+    `login_required`, `permission`, `concurrent` and `cache`), plus the checks
+    that the dispatcher runs for each call, bound ahead of time.
+    """
+    def __init__(self, action, name, **info):
+        super(RemotingMethod, self).__init__(info)
+        self.action = action
+        self.name = name
+        self.func = info['func']
+        self.len = info['len']
+        self.cache = info['cache']
+        
+        self.checks = []
+        if info['login_required']:
+            self.checks.append(self.check_login)
+        if info['permission']:
+            self.checks.append(self.check_permission)
+    
+    def check_login(self, request):
+        if not get_auth(request).is_authenticated():
+            return dict(success=False, message='You must be authenticated to run this method.')
+    
+    def check_permission(self, request):
+        if not get_auth(request).has_perm(self['permission']):
+            return dict(success=False, messsage='You need `%s` permission to run this method' % self['permission'])
+    
+    def check(self, request):
+        """
+        Return the result to send if the `request` can't run this method, None otherwise.
+        """
+        for check in self.checks:
+            result = check(request)
+            if result is not None:
+                return result
+        return None
     
+    def validate(self, data):
+        """
+        Return an error message if the method expects `len` arguments and `data`
+        has less. Methods registered with len=0 get whatever the client sends.
+        """
+        if not self.len:
+            return None
+        if data is None:
+            given = 0
+        elif isinstance(data, list):
+            given = len(data)
+        else:
+            return '`%s.%s` expects a list of arguments' % (self.action, self.name)
+        if given < self.len:
+            return '`%s.%s` expects %d arguments, %d given' % (self.action, self.name, self.len, given)
+        return None
+    
+    def form_data(self, request):
+        data = request.POST.copy()
+        for param in FORM_PARAMS:
+            data.pop(param, None)
+        return data
+
 class ExtRemotingProvider(ExtDirectProvider):
     """
     ExtDirect RemotingProvider implementation
@@ -81,30 +292,66 @@ class ExtRemotingProvider(ExtDirectProvider):
     
     type = 'remoting'
     
-    def __init__(self, namespace, url, id=None, descriptor='Descriptor'):
+    def __init__(self, namespace, url, id=None, descriptor='Descriptor', \
+                 concurrent_batch=False, max_workers=4, instrumentation=None, \
+                 max_request_size=MAX_REQUEST_SIZE, permission_backend=None, compression=None):
         super(ExtRemotingProvider, self).__init__(url, self.type, id)
         
         self.namespace = namespace        
         self.actions = {}
         self.descriptor = descriptor
+        
+        #If `concurrent_batch` it's True, the calls received in batch
+        #will be dispatched using a pool of (at most) `max_workers` threads.
+        #The pool it's shared by all the requests and started the first time it's needed.
+        self.concurrent_batch = concurrent_batch
+        self.max_workers = max_workers
+        self._tasks = None
+        self._pool_lock = threading.Lock()
+        
+        #Measure every call, see extdirect.django.instrumentation
+        self.instrumentation = instrumentation
+        
+        #JSON requests bigger than `max_request_size` bytes are rejected
+        #without reading them (None means no limit). Form posts are handled by Django.
+        self.max_request_size = max_request_size
+        
+        #The user's permissions are checked once per request (for all the calls
+        #in a batch) with this backend, see extdirect.django.permissions
+        self.permission_backend = permission_backend
+        
+        #Compress the responses (gzip or brotli, as accepted by the client),
+        #see extdirect.django.compression
+        self.compression = compression
 
 
+    def _get_actions(self):
+        return self._actions
+    
+    def _set_actions(self, actions):
+        self._actions = actions
+        self._invalidate()
+    
+    actions = property(_get_actions, _set_actions)
+    
     def api(self, request):
-        conf = self._config
         descriptor = self.namespace + '.' + self.descriptor
         
         if request.GET.has_key('format') and request.GET['format'] == 'json':
-            conf['descriptor'] = descriptor
-            mimetype = 'application/json'
-            response = simplejson.dumps(conf)
+            def build():
+                conf = self._config
+                conf['descriptor'] = descriptor
+                return simplejson.dumps(conf)
+            
+            return self._descriptor_response(request, 'api-json', build, 'application/json')
         else:
-            response = """
+            def build():
+                return """
 Ext.ns('%s');
 %s = %s
 """ % (self.namespace, descriptor, simplejson.dumps(self._config))
-            mimetype = 'text/javascript'
             
-        return HttpResponse(response, mimetype=mimetype)
+            return self._descriptor_response(request, 'api', build, 'text/javascript')
         
     @property
     def _config(self):
@@ -128,8 +375,12 @@ Ext.ns('%s');
         return config    
 
     def register(self, method, action=None, name=None, len=0, form_handler=False, \
-                 login_required=False, permission=None):
-        
+                 login_required=False, permission=None, concurrent=True, cache=None):
+        """
+        Register `method` as `action`.`name`. If you give a `cache`
+        (an instance of extdirect.django.cache.ResponseCache) the results
+        of the method are cached, see `invalidate_cache`.
+        """
         if not action:
             action = method.__module__.replace('.', '_')
             
@@ -139,11 +390,35 @@ Ext.ns('%s');
         
         #if name it's None, we use the real function name.
         name = name or method.__name__  
-        self.actions[action][name] = dict(func=method,
-                                          len=len,
-                                          form_handler=form_handler,
-                                          login_required=login_required,
-                                          permission=permission)        
+        self.actions[action][name] = RemotingMethod(action, name,
+                                                    func=method,
+                                                    len=len,
+                                                    form_handler=form_handler,
+                                                    login_required=login_required,
+                                                    permission=permission,
+                                                    concurrent=concurrent,
+                                                    cache=cache)
+        self._invalidate()
+    
+    def lookup(self, action, method):
+        """
+        Return the RemotingMethod registered as `action`.`method` or None.
+        """
+        try:
+            return self.actions[action][method]
+        except (KeyError, TypeError):
+            return None
+    
+    def invalidate_cache(self, action, method=None):
+        """
+        Drop the cached responses of `method` (or all the methods) of `action`.
+        """
+        if method is None:
+            methods = self.actions.get(action, {}).keys()
+        else:
+            methods = [method]
+        for method in methods:
+            invalidate_method(action, method)
         
     def dispatcher(self, request, extdirect_req):
         """
@@ -155,67 +430,218 @@ Ext.ns('%s');
         `extdirect_post_data` attribute.
         """
         
-        action = extdirect_req['action']
-        method = extdirect_req['method']
-        
-        func = self.actions[action][method]['func']        
+        action = extdirect_req.get('action')
+        method = extdirect_req.get('method')
+        remoting = self.lookup(action, method)
         
+        is_form = extdirect_req.get('isForm')
         data = None
-        if not extdirect_req.get('isForm'):
-            data = extdirect_req.pop('data')
+        if not is_form:
+            data = extdirect_req.pop('data', None)
         
         #the response object will be the same recieved but without `data`.
         #we will add the `result` later.
         response = extdirect_req
         
+        if remoting is None:
+            response['type'] = 'exception'
+            response['message'] = 'Unknown method `%s.%s`' % (action, method)
+            return response
+        
         #Checks for login or permissions required
-        login_required = self.actions[action][method]['login_required']
-        if(login_required):            
-            if not request.user.is_authenticated():                
-                response['result'] = dict(success=False, message='You must be authenticated to run this method.')
-                return response
-            
-        permission = self.actions[action][method]['permission']
-        if(permission):            
-            if not request.user.has_perm(permission):                
-                response['result'] = dict(success=False, messsage='You need `%s` permission to run this method' % permission)
+        result = remoting.check(request)
+        if result is not None:
+            response['result'] = result
+            return response
+        
+        if is_form:
+            request.extdirect_post_data = remoting.form_data(request)
+        else:
+            message = remoting.validate(data)
+            if message:
+                response['type'] = 'exception'
+                response['message'] = message
                 return response
-                
-        if data:
-            #this is a simple hack to convert all the dictionaries keys
-            #to strings instead of unicodes. {u'key': u'value'} --> {'key': u'value'}
-            #This is needed if the function called want to pass the dictionaries as kw arguments.
-            params = []
-            for param in data:
-                if isinstance(param, dict):
-                    param = dict(map(lambda x: (str(x[0]), x[1]), param.items()))
-                params.append(param)
-                
-            #Add the `extdirect_post_data` attribute to the request instance
-            request.extdirect_post_data = params
             
-        if extdirect_req.get('isForm'):
-            extdirect_post_data = request.POST.copy()
-            extdirect_post_data.pop('extAction')
-            extdirect_post_data.pop('extMethod')
-            extdirect_post_data.pop('extTID')
-            extdirect_post_data.pop('extType')
-            extdirect_post_data.pop('extUpload')
-            
-            request.extdirect_post_data = extdirect_post_data
+            if data:
+                #Add the `extdirect_post_data` attribute to the request instance.
+                #The keys of the dictionaries are already strings (see `parse_json`)
+                request.extdirect_post_data = data
         
         #finally, call the function passing the `request`
+        func = remoting.func
+        cache = remoting.cache
+        call = None
+        if self.instrumentation:
+            call = self.instrumentation.start(action, method)
         try:
-            response['result'] = func(request)
-        except Exception, e:            
-            if settings.DEBUG:
-                etype, evalue, etb = sys.exc_info()
-                response['type'] = 'exception'                
-                response['message'] = traceback.format_exception_only(etype, evalue)[0]
-                response['where'] = traceback.extract_tb(etb)[-1]
+            try:
+                if cache and not is_form:
+                    response['result'] = cache.call(func, request, action, method, data)
+                else:
+                    response['result'] = func(request)
+                if call:
+                    #we encode the result here to know its size, the router will use it as it's
+                    response['result'] = call.encode(response['result'], get_encoder())
+            except Exception, e:            
+                if call:
+                    call.exception = e.__class__.__name__
+                if settings.DEBUG:
+                    etype, evalue, etb = sys.exc_info()
+                    response['type'] = 'exception'                
+                    response['message'] = traceback.format_exception_only(etype, evalue)[0]
+                    response['where'] = traceback.extract_tb(etb)[-1]
+                else:
+                    raise e
+        finally:
+            if call:
+                self.instrumentation.finish(call)
+        
+        return response
+    
+    def prefetch(self, response):
+        """
+        Fetch the first chunk of every streamed result (in this thread, it's the
+        one sending the response). The errors of the queries get the same
+        exception response as the errors of the methods, instead of breaking
+        the JSON once it's being sent.
+        """
+        if not isinstance(response, list):
+            response = [response]
+        for single in response:
+            try:
+                prefetch(single.get('result'))
+            except Exception, e:
+                if settings.DEBUG:
+                    etype, evalue, etb = sys.exc_info()
+                    del single['result']
+                    single['type'] = 'exception'
+                    single['message'] = traceback.format_exception_only(etype, evalue)[0]
+                    single['where'] = traceback.extract_tb(etb)[-1]
+                else:
+                    raise e
+    
+    def prepare_auth(self, request, extdirect_requests):
+        """
+        Create the AuthContext of the `request` and check (at once) all the
+        permissions needed by the calls, if any of them needs it.
+        """
+        if not isinstance(extdirect_requests, list):
+            extdirect_requests = [extdirect_requests]
+        
+        needed = False
+        perms = []
+        for extdirect_req in extdirect_requests:
+            try:
+                remoting = self.lookup(extdirect_req.get('action'), extdirect_req.get('method'))
+            except AttributeError:
+                continue
+            if remoting is not None and remoting.checks:
+                needed = True
+                if remoting['permission']:
+                    perms.append(remoting['permission'])
+        
+        if needed:
+            auth = request.extdirect_auth = AuthContext(request.user, self.permission_backend)
+            if perms:
+                auth.prefetch(perms)
+    
+    def _is_concurrent(self, extdirect_req):
+        try:
+            remoting = self.lookup(extdirect_req.get('action'), extdirect_req.get('method'))
+        except AttributeError:
+            remoting = None
+        #Let the dispatcher deal with the bad requests in the main thread
+        return remoting is not None and remoting['concurrent']
+    
+    def _worker(self):
+        """
+        Run the tasks of the pool forever. The DB connections are closed after
+        every task, they belong to this thread and not to the request.
+        """
+        while True:
+            index, request, extdirect_req, done = self._tasks.get()
+            try:
+                try:
+                    done.put((index, self.dispatcher(request, extdirect_req), None))
+                except Exception:
+                    done.put((index, None, sys.exc_info()))
+            finally:
+                for conn in connections.all():
+                    conn.close()
+    
+    def _start_pool(self):
+        """
+        Start the `self.max_workers` threads of the pool (only once).
+        """
+        self._pool_lock.acquire()
+        try:
+            if self._tasks is None:
+                self._tasks = Queue()
+                for i in range(self.max_workers):
+                    thread = threading.Thread(target=self._worker,
+                                              name='extdirect-worker-%d' % i)
+                    #don't keep the process alive only for the pool
+                    thread.setDaemon(True)
+                    thread.start()
+        finally:
+            self._pool_lock.release()
+    
+    def _dispatch_group(self, request, group, response):
+        """
+        Dispatch a group of (index, extdirect_req) in the pool of threads.
+        The pool it's shared by all the requests, so `self.max_workers` bounds
+        the threads of the whole process. Each call gets its own shallow copy
+        of the `request` (the dispatcher sets `extdirect_post_data` on it).
+        """
+        if self._tasks is None:
+            self._start_pool()
+            
+        done = Queue()
+        for index, extdirect_req in group:
+            self._tasks.put((index, copy.copy(request), extdirect_req, done))
+            
+        errors = []
+        for i in range(len(group)):
+            index, result, error = done.get()
+            if error:
+                errors.append((index, error))
             else:
-                raise e
+                response[index] = result
+            
+        if errors:
+            #same as in a sequential batch, the first exception wins
+            errors.sort()
+            etype, evalue, etb = errors[0][1]
+            raise etype, evalue, etb
+    
+    def batch_dispatcher(self, request, extdirect_requests):
+        """
+        Dispatch a batch of ExtDirect requests concurrently.
         
+        Consecutive calls to methods registered with `concurrent=True` (the default)
+        are run together in the threads pool. A method registered with `concurrent=False`
+        works as a barrier: it waits for the previous calls, runs alone in the
+        current thread and then the batch goes on.
+        The responses are returned in the same order (tid) as the requests.
+        """
+        #Make sure that the lazy user (if any) it's resolved before we copy the request
+        getattr(request, 'user', None)
+        
+        response = [None] * len(extdirect_requests)
+        group = []
+        for index, extdirect_req in enumerate(extdirect_requests):
+            if self._is_concurrent(extdirect_req):
+                group.append((index, extdirect_req))
+            else:
+                if group:
+                    self._dispatch_group(request, group, response)
+                    group = []
+                response[index] = self.dispatcher(request, extdirect_req)
+                
+        if group:
+            self._dispatch_group(request, group, response)
+            
         return response
         
     def router(self, request):
@@ -223,7 +649,23 @@ Ext.ns('%s');
         Check if the request came from a Form POST and call
         the dispatcher for every ExtDirect request recieved.
         """
-        if request.POST.has_key('extAction'):
+        #Only a Form POST could have `extAction`, we don't parse the JSON body as a form
+        content_type = request.META.get('CONTENT_TYPE', '')
+        is_form = content_type.startswith('multipart') or \
+                  content_type.startswith('application/x-www-form-urlencoded')
+        
+        #Only the JSON bodies are limited, form posts (e.g. uploads) are handled by Django
+        body = None
+        if not is_form:
+            body, too_large = read_body(request, self.max_request_size)
+            if too_large:
+                response = dict(type='exception',
+                                message='The request is too large (max. %d bytes)' % self.max_request_size)
+                if body:
+                    response.update(call_ids(body))
+                return HttpResponse(get_encoder().encode(response), mimetype='application/json')
+        
+        if is_form and request.POST.has_key('extAction'):
             extdirect_request = dict(
                 action = request.POST['extAction'],
                 method = request.POST['extMethod'],
@@ -231,17 +673,23 @@ Ext.ns('%s');
                 type = request.POST['extType'],
                 isForm = True
             )        
-        elif request.raw_post_data:
-            extdirect_request = simplejson.loads(request.raw_post_data)            
-            
         else:
-            return HttpResponseBadRequest('Invalid request')
+            if is_form:
+                body = request.raw_post_data
+            if not body:
+                return HttpResponseBadRequest('Invalid request')
+            extdirect_request = parse_json(body)
 
+        self.prepare_auth(request, extdirect_request)
+        
         if isinstance(extdirect_request, list):
             #call in batch
-            response = []
-            for single_request in extdirect_request:
-                response.append(self.dispatcher(request, single_request))
+            if self.concurrent_batch and len(extdirect_request) > 1:
+                response = self.batch_dispatcher(request, extdirect_request)
+            else:
+                response = []
+                for single_request in extdirect_request:
+                    response.append(self.dispatcher(request, single_request))
 
         elif isinstance(extdirect_request, dict):
            #single call
@@ -253,14 +701,25 @@ Ext.ns('%s');
         else:
             mimetype = 'application/json'
             
-        return HttpResponse(simplejson.dumps(response, cls=DjangoJSONEncoder), mimetype=mimetype)
+        if is_streamed(response):
+            self.prefetch(response)
+            content = StreamedResponse(response, get_encoder())
+            if not content.lazy:
+                content = ''.join(content)
+        else:
+            content = get_encoder().encode(response)
+        
+        if self.compression is not None:
+            return self.compression.response(request, content, mimetype)
+        return HttpResponse(content, mimetype=mimetype)
         
 
 class ExtPollingProvider(ExtDirectProvider):
     
     type = 'polling'
     
-    def __init__(self, url, event, func=None, login_required=False, permission=None, id=None):
+    def __init__(self, url, event, func=None, login_required=False, permission=None, id=None, \
+                 broker=None, timeout=25):
         super(ExtPollingProvider, self).__init__(url, self.type, id)
         
         self.func = func
@@ -269,6 +728,11 @@ class ExtPollingProvider(ExtDirectProvider):
         self.login_required = login_required
         self.permission = permission
         
+        #Long-poll mode: if you give a `broker` (see extdirect.django.brokers),
+        #the router waits (at most `timeout` seconds) until an event it's published.
+        self.broker = broker
+        self.timeout = timeout
+        
     @property
     def _config(self):
         config = {
@@ -285,6 +749,29 @@ class ExtPollingProvider(ExtDirectProvider):
         self.login_required = login_required
         self.permission = permission
     
+    def publish(self, data=None):
+        """
+        Publish an event (in long-poll mode). The waiting requests get `data`,
+        or the result of the registered function if there is one.
+        It returns the version of the event.
+        """
+        return self.broker.publish(self.event, data)
+    
+    def wait_events(self, request):
+        """
+        Wait for the events published after the version sent by the client
+        (the `since` parameter). Without it, we wait for the next event.
+        """
+        try:
+            since = int(request.REQUEST['since'])
+        except (KeyError, ValueError):
+            since = self.broker.latest()
+        
+        #Don't hold the database connections while we wait
+        for conn in connections.all():
+            conn.close()
+        return self.broker.wait(self.event, since, self.timeout)
+    
     def router(self, request):
         response = {}
 
@@ -293,20 +780,31 @@ class ExtPollingProvider(ExtDirectProvider):
                 response['type'] = 'event'
                 response['data'] = 'You must be authenticated to run this method.'
                 response['name'] = self.event
-                return HttpResponse(simplejson.dumps(response, cls=DjangoJSONEncoder), mimetype='application/json')
+                return HttpResponse(get_encoder().encode(response), mimetype='application/json')
                 
         if(self.permission):            
             if not request.user.has_perm(self.permission):
                 response['type'] = 'result'
                 response['data'] = 'You need `%s` permission to run this method' % self.permission
                 response['name'] = self.event
-                return HttpResponse(simplejson.dumps(response, cls=DjangoJSONEncoder), mimetype='application/json')
+                return HttpResponse(get_encoder().encode(response), mimetype='application/json')
+        
+        events = None
+        if self.broker is not None:
+            events = self.wait_events(request)
+            if not events or not self.func:
+                #An empty list if nothing was published
+                events = [dict(type='event', name=self.event, data=data, version=version)
+                          for version, data in events]
+                return HttpResponse(get_encoder().encode(events), mimetype='application/json')
         
         try:
             if self.func:
                 response['data'] = self.func(request)
                 response['name'] = self.event
                 response['type'] = 'event'                
+                if events:
+                    response['version'] = events[-1][0]
             else:
                 raise RuntimeError("The server provider didn't register a function to run yet")
                 
@@ -319,4 +817,132 @@ class ExtPollingProvider(ExtDirectProvider):
             else:
                 raise e
         
-        return HttpResponse(simplejson.dumps(response, cls=DjangoJSONEncoder), mimetype='application/json')
+        return HttpResponse(get_encoder().encode(response), mimetype='application/json')
+
+class EventProducer(object):
+    """
+    An event registered in an ExtMultiPollingProvider.
+    """
+    def __init__(self, event, func, login_required=False, permission=None, version=None):
+        self.event = event
+        self.func = func
+        self.login_required = login_required
+        self.permission = permission
+        self.version = version
+    
+    def check(self, request):
+        """
+        Return the error message if the `request` can't run this producer, None otherwise.
+        """
+        auth = get_auth(request)
+        if self.login_required and not auth.is_authenticated():
+            return 'You must be authenticated to run this method.'
+        if self.permission and not auth.has_perm(self.permission):
+            return 'You need `%s` permission to run this method' % self.permission
+        return None
+
+class ExtMultiPollingProvider(ExtPollingProvider):
+    """
+    Polling provider that runs many event producers in one poll, so a client
+    only needs one polling connection. The router returns an array of events
+    (one by producer), each one with the `version` of its data.
+    
+    The client sends back the versions it has seen as a JSON dict
+    {event: version} in the `versions` parameter (e.g. in the `baseParams` of
+    the Ext.direct.PollingProvider) and the producers whose version didn't
+    change are skipped:
+    
+     - Without a broker, the version of a producer it's the result of its
+       `version(request)` function. Producers without it always run.
+     - In long-poll mode (with a `broker`), the version of a producer it's the
+       one of the last event published to its channel (`publish(event)`), and
+       the router waits until one of them changes. Producers that the client
+       didn't see yet run right away (with the version of their channel).
+    """
+    def __init__(self, url, id=None, broker=None, timeout=25):
+        #There isn't a single `event` (or `func`), see `producers`
+        super(ExtMultiPollingProvider, self).__init__(url, None, id=id, broker=broker, timeout=timeout)
+        self.producers = []
+    
+    def register(self, func, login_required=False, permission=None, event=None, version=None):
+        """
+        Register `func` as the producer of `event` (the name of the function by default).
+        """
+        event = event or func.__name__
+        self.producers = [p for p in self.producers if p.event != event]
+        self.producers.append(EventProducer(event, func, login_required, permission, version))
+    
+    def publish(self, event, data=None):
+        """
+        Publish an event (in long-poll mode) so the clients run its producer again.
+        It returns the version of the event.
+        """
+        return self.broker.publish(event, data)
+    
+    def seen_versions(self, request):
+        """
+        Return the dict {event: version} sent by the client.
+        """
+        try:
+            versions = simplejson.loads(request.REQUEST['versions'])
+        except (KeyError, ValueError):
+            return {}
+        if not isinstance(versions, dict):
+            return {}
+        return versions
+    
+    def changed_producers(self, request, seen):
+        """
+        Return a list of (producer, version) with the producers to run.
+        """
+        if self.broker is None:
+            changed = []
+            for producer in self.producers:
+                version = producer.version and producer.version(request)
+                if version is None or producer.event not in seen or seen[producer.event] != version:
+                    changed.append((producer, version))
+            return changed
+        
+        unseen = [p for p in self.producers if p.event not in seen]
+        if unseen:
+            return [(producer, self.broker.latest(producer.event)) for producer in unseen]
+        
+        channels = {}
+        for producer in self.producers:
+            try:
+                channels[producer.event] = int(seen[producer.event])
+            except (TypeError, ValueError):
+                channels[producer.event] = self.broker.latest(producer.event)
+        
+        #Don't hold the database connections while we wait
+        for conn in connections.all():
+            conn.close()
+        found = self.broker.wait_any(channels, self.timeout)
+        return [(producer, found[producer.event][-1][0])
+                for producer in self.producers if producer.event in found]
+    
+    def run(self, request, producer, version):
+        event = dict(type='event', name=producer.event)
+        message = producer.check(request)
+        if message is not None:
+            event['data'] = message
+            return event
+        
+        try:
+            event['data'] = producer.func(request)
+            if version is not None:
+                event['version'] = version
+        except Exception, e:
+            if settings.DEBUG:
+                etype, evalue, etb = sys.exc_info()
+                event['type'] = 'exception'
+                event['message'] = traceback.format_exception_only(etype, evalue)[0]
+                event['where'] = traceback.extract_tb(etb)[-1]
+            else:
+                raise e
+        return event
+    
+    def router(self, request):
+        changed = self.changed_producers(request, self.seen_versions(request))
+        events = [self.run(request, producer, version) for producer, version in changed]
+        return HttpResponse(get_encoder().encode(events), mimetype='application/json')
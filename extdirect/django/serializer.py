@@ -1,7 +1,65 @@
 from django.core.serializers import python
+from django.db import models
 from StringIO import StringIO
+import types, datetime, decimal
+from itertools import islice, izip
 from django.utils.encoding import smart_str, smart_unicode
 from django.utils import datetime_safe
+from streaming import RecordStream
+
+#Compiled field plans, see Serializer.field_plan
+_plans = {}
+
+#Same as django.utils.encoding.is_protected_type (plus unicode) but we
+#look for the exact class in a set, it's much faster than isinstance.
+_unchanged_types = frozenset([unicode, types.NoneType, int, long, bool, float,
+                              decimal.Decimal, datetime.datetime, datetime.date, datetime.time])
+
+def to_unicode(value):
+    """
+    Faster smart_unicode(value, strings_only=True) for the most common values.
+    """
+    if value.__class__ in _unchanged_types:
+        return value
+    return smart_unicode(value, strings_only=True)
+
+#The values of these fields are converted to strings while the records are
+#built (in the same formats used by DjangoJSONEncoder, "%Y-%m-%d %H:%M:%S"),
+#so the JSON encoder doesn't need a `default` function for them.
+def datetime_to_json(value):
+    if value.__class__ is datetime.datetime:
+        return u'%04d-%02d-%02d %02d:%02d:%02d' % (value.year, value.month, value.day,
+                                                   value.hour, value.minute, value.second)
+    return to_unicode(value)
+
+def date_to_json(value):
+    if value.__class__ is datetime.date:
+        return u'%04d-%02d-%02d' % (value.year, value.month, value.day)
+    return to_unicode(value)
+
+def time_to_json(value):
+    if value.__class__ is datetime.time:
+        return u'%02d:%02d:%02d' % (value.hour, value.minute, value.second)
+    return to_unicode(value)
+
+def decimal_to_json(value):
+    if value.__class__ is decimal.Decimal:
+        return unicode(value)
+    return to_unicode(value)
+
+def json_converter(field):
+    """
+    Return the function that converts the values of `field` for the records.
+    """
+    if isinstance(field, models.DateTimeField):
+        return datetime_to_json
+    if isinstance(field, models.DateField):
+        return date_to_json
+    if isinstance(field, models.TimeField):
+        return time_to_json
+    if isinstance(field, models.DecimalField):
+        return decimal_to_json
+    return to_unicode
 
 class Serializer(python.Serializer):
     """    
@@ -18,43 +76,231 @@ class Serializer(python.Serializer):
         if total == 1 and single_cast:
             self.objects[self.meta['root']] = self.objects[self.meta['root']][0]
 
-    def start_object(self, obj):
-        self._current = {}
-        
-    def end_object(self, obj):
-        rec = self._current
-        rec[self.meta['idProperty']] = smart_unicode(obj._get_pk_val(), strings_only=True)
-        
-        for extra in self.extras:
-                rec[extra[0]] = extra[1](obj)
-                
-        self.objects[self.meta['root']].append(rec)
-        self._current = None        
-        
-    def handle_field(self, obj, field):
-        self._current[field.name] = smart_unicode(getattr(obj, field.name), strings_only=True)
-
     def handle_fk_field(self, obj, field):
         related = getattr(obj, field.name)
         if related is not None:
             if field.rel.field_name == related._meta.pk.name:
                 # Related to remote object via primary key                
-                self._current[field.name+'_id'] = smart_unicode(related._get_pk_val(), strings_only=True)
-                self._current[field.name] = smart_unicode(related, strings_only=True)                
+                self._current[field.name+'_id'] = to_unicode(related._get_pk_val())
+                self._current[field.name] = to_unicode(related)
             else:
                 # Related to remote object via other field
                 related = getattr(related, field.rel.field_name)
-                self._current[field.name] = self._current[field.name+'_id'] = smart_unicode(getattr(related, field.rel.field_name), strings_only=True)        
+                self._current[field.name] = self._current[field.name+'_id'] = to_unicode(getattr(related, field.rel.field_name))
 
-    def handle_m2m_field(self, obj, field):
-        if field.rel.through._meta.auto_created:
-            if self.use_natural_keys and hasattr(field.rel.to, 'natural_key'):
-                m2m_value = lambda value: value.natural_key()
+    def field_plan(self, model):
+        """
+        Return the compiled field plan for `model` with the current options.
+        
+        The plan it's a tuple (pk attname, fields, fk fields, m2m fields) where
+        `fields` are (name, attname, converter) tuples. Plans are compiled only
+        once for each model and options.
+        """
+        key = (model, self.local_fields, tuple(self.exclude_fields),
+               self.selected_fields is not None and tuple(self.selected_fields),
+               self.use_natural_keys)
+        try:
+            return _plans[key]
+        except KeyError:
+            pass
+        
+        if self.local_fields:
+            fields = model._meta.local_fields
+        else:
+            fields = model._meta.fields
+        
+        plain, fks, m2ms = [], [], []
+        for field in fields:
+            if field.name in self.exclude_fields or not field.serialize:
+                continue
+            if field.rel is None:
+                if self.selected_fields is None or field.attname in self.selected_fields:
+                    plain.append((field.name, field.attname, json_converter(field)))
             else:
-                m2m_value = lambda value: smart_unicode(value._get_pk_val(), strings_only=True)
-            self._current[field.name+'_ids'] = [m2m_value(related)
-                               for related in getattr(obj, field.name).iterator()]
+                if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
+                    fks.append(field)
+        for field in model._meta.many_to_many:
+            if field.serialize and field.rel.through._meta.auto_created:
+                if self.selected_fields is None or field.attname in self.selected_fields:
+                    m2ms.append(field)
+        
+        plan = _plans[key] = (model._meta.pk.attname, tuple(plain), tuple(fks), tuple(m2ms))
+        return plan
+    
+    def records(self, queryset, chunk_size=500):
+        """
+        Generate the records (dicts) for each object in the queryset.
+        ManyToMany fields are resolved with one query by field for every
+        `chunk_size` objects.
+        """
+        id_property = self.meta['idProperty']
+        extras = self.extras
+        objects = iter(queryset)
+        while True:
+            chunk = list(islice(objects, chunk_size))
+            if not chunk:
+                break
+            
+            m2m_maps = {}
+            model = None
+            for obj in chunk:
+                if obj.__class__ is not model:
+                    model = obj.__class__
+                    pk, plain, fks, m2ms = self.field_plan(model)
+                    if m2ms and model not in m2m_maps:
+                        pks = [o._get_pk_val() for o in chunk if o.__class__ is model]
+                        m2m_maps[model] = [(field.name + '_ids', self.m2m_values(field, pks))
+                                           for field in m2ms]
+                
+                rec = self._current = {}
+                for name, attname, convert in plain:
+                    rec[name] = convert(getattr(obj, attname))
+                for field in fks:
+                    self.handle_fk_field(obj, field)
+                if m2ms:
+                    obj_pk = getattr(obj, pk)
+                    for name, values in m2m_maps[model]:
+                        rec[name] = values[obj_pk]
+                
+                rec[id_property] = to_unicode(getattr(obj, pk))
+                for extra in extras:
+                    rec[extra[0]] = extra[1](obj)
                 
+                self._current = None
+                yield rec
+    
+    def fk_values(self, field, ids):
+        """
+        Return a dict {fk value: (`name_id` value, `name` value)} for the
+        ForeignKey `field`, loading all the related objects with only one query.
+        """
+        if field.rel.field_name != field.rel.to._meta.pk.name:
+            # Related to remote object via other field, the column has the value
+            return dict((id, (to_unicode(id), to_unicode(id))) for id in ids)
+        
+        related = field.rel.to._default_manager.in_bulk(list(ids))
+        result = {}
+        for id in ids:
+            try:
+                obj = related[id]
+            except KeyError:
+                raise field.rel.to.DoesNotExist
+            result[id] = (to_unicode(obj._get_pk_val()), to_unicode(obj))
+        return result
+    
+    def m2m_values(self, field, pks):
+        """
+        Return a dict {pk: [related values]} for the ManyToMany `field`
+        using only one query (on the intermediary table).
+        """
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        result = dict((pk, []) for pk in pks)
+        
+        qs = field.rel.through._default_manager.filter(**{'%s__in' % source: list(pks)})
+        ordering = [o for o in field.rel.to._meta.ordering if o != '?']
+        if ordering:
+            #Keep the same order that we would get from the related manager
+            qs = qs.order_by(*[o[0] == '-' and '-%s__%s' % (target, o[1:]) or '%s__%s' % (target, o)
+                               for o in ordering])
+        pairs = qs.values_list(source, target)
+        
+        if self.use_natural_keys and hasattr(field.rel.to, 'natural_key'):
+            pairs = list(pairs)
+            related = field.rel.to._default_manager.in_bulk(list(set([t for s, t in pairs])))
+            for s, t in pairs:
+                result[s].append(related[t].natural_key())
+        else:
+            for s, t in pairs:
+                result[s].append(to_unicode(t))
+        return result
+    
+    def values_records(self, queryset, chunk_size=500, streaming=False, columns=None):
+        """
+        Generate the same records as `records` but from `queryset.values_list()`,
+        without building the model instances. ForeignKeys and ManyToMany fields
+        are resolved with one query by field for every `chunk_size` rows.
+        
+        If `columns` (a list of record keys) it's given, each record it's a list
+        with the values of those keys instead of a dict (see `values_arrays`).
+        """
+        pk, plain, fks, m2ms = self.field_plan(queryset.model)
+        fk_start = len(plain) + 1
+        rows = queryset.values_list(pk, *([attname for name, attname, convert in plain] + 
+                                          [field.attname for field in fks]))
+        if streaming:
+            rows = rows.iterator()
+        else:
+            rows = iter(rows)
+        
+        id_property = self.meta['idProperty']
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            
+            fk_maps = []
+            for i, field in enumerate(fks):
+                ids = set([row[fk_start + i] for row in chunk])
+                ids.discard(None)
+                fk_maps.append((field.name, field.name + '_id', fk_start + i, self.fk_values(field, ids)))
+            pks = [row[0] for row in chunk]
+            m2m_maps = [(field.name + '_ids', self.m2m_values(field, pks)) for field in m2ms]
+            
+            if columns is not None:
+                for rec in self.values_arrays(chunk, columns, plain, fk_maps, m2m_maps):
+                    yield rec
+                continue
+            
+            for row in chunk:
+                rec = {}
+                for (name, attname, convert), value in izip(plain, row[1:fk_start]):
+                    rec[name] = convert(value)
+                for name, name_id, index, values in fk_maps:
+                    if row[index] is not None:
+                        rec[name_id], rec[name] = values[row[index]]
+                for name, values in m2m_maps:
+                    rec[name] = values[row[0]]
+                rec[id_property] = to_unicode(row[0])
+                yield rec
+
+    def values_arrays(self, chunk, columns, plain, fk_maps, m2m_maps):
+        """
+        Generate a list with the values of `columns` for each row of `chunk`
+        (a chunk of `values_records`), without building the record dicts.
+        """
+        #The values of a row are converted in the order of the query (the pk,
+        #the plain fields, the ForeignKeys and the ManyToMany fields, plus a None
+        #for the unknown columns), then we pick them in the order of `columns`.
+        names = [self.meta['idProperty']] + [name for name, attname, convert in plain]
+        converters = [to_unicode] + [convert for name, attname, convert in plain]
+        for name, name_id, index, values in fk_maps:
+            names.extend([name_id, name])
+        names.extend([name for name, values in m2m_maps])
+        
+        positions = {}
+        for position, name in reversed(list(enumerate(names))):
+            positions[name] = position
+        indexes = [positions.get(column, len(names)) for column in columns]
+        
+        for row in chunk:
+            rec = [convert(value) for convert, value in izip(converters, row)]
+            for name, name_id, index, values in fk_maps:
+                if row[index] is None:
+                    rec.extend((None, None))
+                else:
+                    rec.extend(values[row[index]])
+            for name, values in m2m_maps:
+                rec.append(values[row[0]])
+            rec.append(None)
+            yield [rec[i] for i in indexes]
+    
+    def arrays(self, records, columns):
+        """
+        Convert the `records` (dicts) to lists with the values of `columns`.
+        """
+        for rec in records:
+            yield [rec.get(column) for column in columns]
+    
     def serialize(self, queryset, **options):
         """
         Serialize a queryset.
@@ -72,31 +318,35 @@ class Serializer(python.Serializer):
         self.extras = options.get('extras', [])
         
         single_cast = options.get('single_cast', False)     
-        total = options.get("total", queryset.count())   
+        if 'total' in options:
+            total = options['total']
+        else:
+            total = queryset.count()
 
+        streaming = options.get('streaming', False)
+        chunk_size = options.get('chunk_size', 500)
+        
+        #If `columns` it's given, the records are lists with the values of
+        #those keys (in the same order), e.g. for an Ext.data.ArrayReader.
+        columns = options.get('columns')
+        
         self.start_serialization(total)
-                        
-        for obj in queryset:
-            if self.local_fields:
-                fields = obj._meta.local_fields
-            else:
-                fields = obj._meta.fields
-            
-            fields = [f for f in fields if f.name not in self.exclude_fields]    
-            self.start_object(obj)
-            for field in fields:
-                if field.serialize:
-                    if field.rel is None:
-                        if self.selected_fields is None or field.attname in self.selected_fields:
-                            self.handle_field(obj, field)
-                    else:
-                        if self.selected_fields is None or field.attname[:-3] in self.selected_fields:
-                            self.handle_fk_field(obj, field)
-            for field in obj._meta.many_to_many:
-                if field.serialize:
-                    if self.selected_fields is None or field.attname in self.selected_fields:
-                        self.handle_m2m_field(obj, field)
-            self.end_object(obj)
+        
+        if options.get('values', False) and not self.extras and hasattr(queryset, 'values_list'):
+            #`extras` need the model instances
+            records = self.values_records(queryset, chunk_size, streaming, columns)
+        else:
+            if streaming and hasattr(queryset, 'iterator'):
+                queryset = queryset.iterator()
+            records = self.records(queryset, chunk_size)
+            if columns is not None:
+                records = self.arrays(records, columns)
+        
+        if streaming:
+            self.objects[self.meta['root']] = RecordStream(records, chunk_size)
+            return self.getvalue()
+        
+        self.objects[self.meta['root']].extend(records)
         self.end_serialization(total, single_cast)
         return self.getvalue()    
 
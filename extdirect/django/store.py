@@ -1,6 +1,68 @@
+import base64
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.serializers import serialize
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
 from metadata import meta_fields
+from totals import ExactTotal
+from streaming import RecordStream, RawJSON
+from encoders import dumps
+from cache import cache_key, model_versions, related_models, watch_related
+from filters import QueryTranslator, QueryError, decode_list, model_fields
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(simplejson.dumps(data, cls=DjangoJSONEncoder))
+
+class _FingerprintEncoder(DjangoJSONEncoder):
+    #Anything else in the metadata (e.g. a callable `defaultValue`) by its repr
+    def default(self, o):
+        try:
+            return super(_FingerprintEncoder, self).default(o)
+        except TypeError:
+            return repr(o)
+
+def metadata_fingerprint(metadata):
+    """
+    Return a stable hash of `metadata` (the same for equal dicts, whatever the order of the keys).
+    """
+    content = simplejson.dumps(metadata, sort_keys=True, cls=_FingerprintEncoder)
+    return md5_constructor(content).hexdigest()
+
+def decode_cursor(cursor):
+    """
+    Return the dict encoded in `cursor` or None if it's not a valid cursor.
+    """
+    try:
+        data = simplejson.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    if isinstance(data, dict) and isinstance(data.get('key'), list):
+        return data
+    return None
+
+def key_fields(model, paths):
+    """
+    Return the fields of the ORM `paths` (following the ForeignKeys) or None.
+    """
+    fields = []
+    for path in paths:
+        names = path.split('__')
+        try:
+            for name in names[:-1]:
+                model = model._meta.get_field(name).rel.to
+            if names[-1] == 'pk':
+                fields.append(model._meta.pk)
+            else:
+                fields.append(model._meta.get_field(names[-1]))
+        except (FieldDoesNotExist, AttributeError):
+            return None
+    return fields
 
 class ExtDirectStore(object):
     """
@@ -11,7 +73,10 @@ class ExtDirectStore(object):
                  success='success', message='message', start='start', limit='limit', \
                  sort='sort', dir='dir', metadata=False, id_property='id', \
                  mappings={}, sort_info={}, custom_meta={}, exclude_fields=[], \
-                 extra_fields=[], get_metadata=None):
+                 extra_fields=[], get_metadata=None, streaming=False, chunk_size=500, \
+                 values=False, keyset=False, cursor='cursor', count=True, total_strategy=None, \
+                 cache_timeout=None, fingerprint='metaFingerprint', arrays=False, \
+                 filter='filter', filter_fields=None, unindexed_sort='allow'):
         
         self.model = model        
         self.root = root
@@ -22,15 +87,69 @@ class ExtDirectStore(object):
         self.message = message
         self.exclude_fields = exclude_fields
         
+        #If `streaming` it's True, the records will be fetched (using queryset.iterator())
+        #and encoded by chunks of `chunk_size` while the response it's being sent.
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        
+        #If `values` it's True, the records will be built from `queryset.values_list()`
+        #instead of model instances (unless you give `extras`, they need the instances).
+        self.values = values
+        
+        #If `keyset` it's True, the pages are fetched using the sort key and the
+        #last id seen (sent back by the client as `cursor`) instead of an OFFSET.
+        self.keyset = keyset
+        
+        #If `count` it's False, we don't run the COUNT query. The total will be
+        #the number of records seen so far (plus one if there are more records).
+        self.count = count
+        
+        #How to get the total (see extdirect.django.totals)
+        self.total_strategy = total_strategy or ExactTotal()
+        
+        #If `cache_timeout` it's given, the pages are cached (see `query`). The key
+        #includes the versions of the model and its related models, that are
+        #invalidated when an instance (or a ManyToMany relation) it's saved or
+        #deleted and by ExtDirectCRUD.
+        self.cache_timeout = cache_timeout
+        if cache_timeout is not None:
+            watch_related(model, exclude_fields)
+        
         # paramNames
         self.start = start
         self.limit = limit
         self.sort = sort
         self.dir = dir
+        self.cursor = cursor
+        self.fingerprint = fingerprint
+        self.filter = filter
+        
+        #The `filter` and `sort` arrays of the client (see extdirect.django.filters)
+        #could only use the fields in `filter_fields` {client name: ORM path}, by
+        #default the fields that the client gets. A sort on a column without index
+        #it's allowed, logged ('flag') or refused, as given by `unindexed_sort`.
+        if filter_fields is None:
+            filter_fields = model_fields(model, mappings, exclude_fields)
+        self.translator = QueryTranslator(model, filter_fields, unindexed_sort)
+        
+        #If `arrays` it's True, each record it's a list with the values of the
+        #metadata `fields` (in the same order) instead of a dict, for an
+        #Ext.data.ArrayReader. The field names aren't repeated in every record.
+        self.arrays = arrays
+        self.columns = None
         
         self.metadata = {}
+        self.metadata_fingerprint = None
+        if metadata or arrays:
+            fields = meta_fields(model, mappings, exclude_fields, get_metadata) + extra_fields
+        if arrays:
+            #The keys of the records (the `mapping` it's the name of the model field)
+            self.columns = [field.get('mapping', field['name']) for field in fields]
+            if id_property not in self.columns:
+                self.columns.append(id_property)
+            #ArrayReader uses the `mapping` as the index in the array
+            fields = [dict(field, mapping=index) for index, field in enumerate(fields)]
         if metadata:            
-            fields = meta_fields(model, mappings, exclude_fields, get_metadata) + extra_fields            
             self.metadata = {
                 'idProperty': id_property,
                 'root': root,
@@ -39,28 +158,89 @@ class ExtDirectStore(object):
                 'fields': fields,
                 'messageProperty': message
             }
+            if arrays:
+                self.metadata['idIndex'] = self.columns.index(id_property)
             if sort_info:
                 self.metadata.update({'sortInfo': sort_info})
                 
             self.metadata.update(custom_meta)        
+            
+            #The clients that send back the fingerprint (the `fingerprint` param)
+            #only get the metaData when it changed, see `query`.
+            self.metadata_fingerprint = metadata_fingerprint(self.metadata)
         
-    def query(self, qs=None, metadata=True, **kw):                
+    def query(self, qs=None, metadata=True, cached=True, **kw):                
+        """
+        Return the page of records (a dict) for the filters and paramNames in `kw`.
+        
+        If the store has a `cache_timeout` (and `cached` it's True) the page it's
+        cached with its records (the `root`) already encoded, as a RawJSON that the
+        router sends as it's. So a cache hit doesn't touch the database nor the
+        JSON encoder. If you need to change the records, use `cached=False`
+        (or decode the `content` of the RawJSON).
+        
+        If the client sends the `fingerprint` param (empty the first time), the
+        result includes the current fingerprint of the metadata and the metaData
+        it's only sent when the client's fingerprint it's stale.
+        
+        The `filter` param and a `sort` param with a list of sorters are translated
+        to ORM lookups (see extdirect.django.filters). If they can't be used, we
+        return a failure (`success` False and the `message`).
+        """
         paginate = False
         total = None
         order = False
+        sort = None
+        desc = False
+        cursor = kw.pop(self.cursor, None)
+        next_cursor = None
+        fingerprint = kw.pop(self.fingerprint, None)
+        if fingerprint is not None and self.metadata_fingerprint:
+            metadata = metadata and fingerprint != self.metadata_fingerprint
+        else:
+            fingerprint = None
         
         if kw.has_key(self.start) and kw.has_key(self.limit):
             start = kw.pop(self.start)
             limit = kw.pop(self.limit)
             paginate = True
             
+        filters = kw.pop(self.filter, None)
+        if filters is not None:
+            filters = decode_list(filters)
+            if filters is None:
+                return self.failure('Invalid `%s` param' % self.filter)
+        
+        sort_keys = None
+        if kw.has_key(self.sort):
+            sorters = decode_list(kw[self.sort])
+            if sorters is not None:
+                kw.pop(self.sort)
+                kw.pop(self.dir, None)
+                try:
+                    sort_keys = self.translator.order_by(sorters)
+                except QueryError, e:
+                    return self.failure(e.args[0])
+                if len(sort_keys) == 1:
+                    #the same as a single `sort` and `dir`
+                    desc = sort_keys[0].startswith('-')
+                    sort = sort_keys[0].lstrip('-')
+                    order = True
+                    sort_keys = None
+                elif sort_keys and self.keyset:
+                    return self.failure('Keyset pagination supports only one sort key')
+            
         if kw.has_key(self.sort) and kw.has_key(self.dir):
             sort = kw.pop(self.sort)
             dir = kw.pop(self.dir)
             order = True
-            
-            if dir == 'DESC':
-                sort = '-' + sort
+            desc = dir == 'DESC'
+            try:
+                #the same whitelist (and client names) as the sorters
+                sort = self.translator.path(sort)
+                self.translator.check_sort(sort)
+            except QueryError, e:
+                return self.failure(e.args[0])
                 
         if not qs is None:
             # Don't use queryset = qs or self.model.objects
@@ -71,26 +251,171 @@ class ExtDirectStore(object):
             queryset = self.model.objects
             
         queryset = queryset.filter(**kw)
+        if filters:
+            try:
+                queryset = self.translator.filter(queryset, filters)
+            except QueryError, e:
+                return self.failure(e.args[0])
+        
+        if not self.values:
+            #The serialized ForeignKeys are loaded in the same query
+            related = [f.name for f in queryset.model._meta.fields
+                       if f.rel and f.serialize and f.name not in self.exclude_fields]
+            if related:
+                queryset = queryset.select_related(*related)
         
         if order:
-            queryset = queryset.order_by(sort)
+            queryset = queryset.order_by(desc and '-' + sort or sort)
+        elif sort_keys:
+            queryset = queryset.order_by(*sort_keys)
+        
+        page_key = None
+        if cached and self.cache_timeout is not None:
+            page_key = self._cache_key(queryset, (metadata, fingerprint is not None), paginate and (start, limit), cursor)
+            if page_key:
+                page = cache.get(page_key)
+                if page is not None:
+                    return page
                 
         if not paginate:
             objects = queryset
-            total = queryset.count()
+            if self.count:
+                total = self.total_strategy.total(queryset)
+            elif not self.streaming and not self.values:
+                objects = list(queryset)
+                total = len(objects)
+        elif self.keyset:
+            objects, size, next_cursor = self._keyset_page(queryset, sort, desc, cursor, start, limit)
+            if self.count:
+                total = self.total_strategy.total(queryset)
+            else:
+                total = start + size + (next_cursor and 1 or 0)
+        elif not self.count and self.values:
+            #The page stays a queryset (the serializer reads it with values_list),
+            #one more key tells if there is a next page
+            total = start + len(queryset.values_list('pk')[start:start + limit + 1])
+            objects = queryset[start:start + limit]
+        elif not self.count:
+            objects = list(queryset[start:start + limit + 1])
+            total = start + len(objects)
+            objects = objects[:limit]
         else:
-            paginator = Paginator(queryset, limit)
-            total = paginator.count
+            total = self.total_strategy.total(queryset)
             
-            try:                
-                page = paginator.page(start / limit + 1)
-            except (EmptyPage, InvalidPage):
+            num_pages = max(1, (total + limit - 1) / limit)
+            page = start / limit + 1
+            out_of_range = page < 1 or page > num_pages
+            if out_of_range and page > 1 and not getattr(self.total_strategy, 'exact', False):
+                #The total could be estimated (or cached) too low, the page may be there anyway
+                out_of_range = not list(queryset.values_list('pk')[start:start + 1])
+            if out_of_range:
                 #out of range, deliver last page of results.
-                page = paginator.page(paginator.num_pages)
+                page = num_pages
             
-            objects = page.object_list
+            objects = queryset[(page - 1) * limit:page * limit]
             
-        return self.serialize(objects, metadata, total)
+        res = self.serialize(objects, metadata, total)
+        if total is None and isinstance(res[self.root], list):
+            #Without `count`, the total of a whole (values) read it's its size
+            res[self.total] = len(res[self.root])
+        if fingerprint is not None:
+            res[self.fingerprint] = self.metadata_fingerprint
+        if self.keyset:
+            res[self.cursor] = next_cursor
+        
+        if page_key:
+            records = res[self.root]
+            if isinstance(records, RecordStream):
+                records = list(records)
+            res[self.root] = RawJSON(dumps(records))
+            cache.set(page_key, res, self.cache_timeout)
+        return res
+    
+    def failure(self, message):
+        return {self.success: False, self.message: message}
+    
+    def _cache_key(self, queryset, metadata, page, cursor):
+        """
+        Return the cache key of a page or None if the query can't be cached.
+        The filters, the sort and the related models loaded are all part of the SQL.
+        """
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return None
+        
+        #The records include the name of the related objects
+        opts = queryset.model._meta
+        return cache_key('extdirect:store', opts.app_label, opts.object_name,
+                         model_versions(related_models(queryset.model, self.exclude_fields)),
+                         sql, params, metadata, page, cursor, self.columns)
+    
+    def _keyset_page(self, queryset, sort, desc, cursor, start, limit):
+        """
+        Return the page (after the key in `cursor`), its size and the cursor for
+        the next one. The page it's sorted by `sort` and the primary key.
+        Without a valid `cursor` (i.e. the first page, a jump to a given page or
+        a cursor of another sort, direction or filters) we can only use `start`
+        as an OFFSET.
+        """
+        pk = queryset.model._meta.pk.name
+        keys = sort in (None, pk, 'pk') and [pk] or [sort, pk]
+        scope = {'sort': keys[0], 'dir': desc and 'DESC' or 'ASC',
+                 'filters': self._filters_digest(queryset)}
+        key = self._cursor_key(queryset.model, keys, scope, cursor)
+        queryset = queryset.order_by(*[desc and '-' + k or k for k in keys])
+        
+        offset = start
+        if key is not None:
+            offset = 0
+            op = desc and 'lt' or 'gt'
+            if len(keys) == 1:
+                seek = Q(**{'%s__%s' % (pk, op): key[0]})
+            else:
+                seek = Q(**{'%s__%s' % (sort, op): key[0]}) | \
+                       Q(**{sort: key[0], '%s__%s' % (pk, op): key[1]})
+            queryset = queryset.filter(seek)
+        
+        #Only the keys, one more to know if there is a next page
+        rows = list(queryset.values_list(*keys)[offset:offset + limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(dict(scope, key=rows[-1]))
+        
+        objects = queryset.filter(pk__in=[row[-1] for row in rows])
+        return objects, len(rows), next_cursor
+        
+    def _filters_digest(self, queryset):
+        #The WHERE of the query, without the ordering
+        try:
+            sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return None
+        return cache_key('extdirect:cursor', sql, params)
+    
+    def _cursor_key(self, model, keys, scope, cursor):
+        """
+        Return the key in `cursor` (converted to the types of the `keys` fields)
+        or None if there is no cursor or it's not valid for this `scope`.
+        """
+        data = cursor and decode_cursor(cursor)
+        if not data or len(data['key']) != len(keys):
+            return None
+        for name, value in scope.items():
+            if data.get(name) != value:
+                return None
+        fields = key_fields(model, keys)
+        if fields is None:
+            return None
+        try:
+            key = [field.to_python(value) for field, value in zip(fields, data['key'])]
+        except (ValidationError, ValueError, TypeError):
+            return None
+        if None in key:
+            #The page ended on a NULL sort value, we can't seek after it
+            return None
+        return key
         
     def serialize(self, queryset, metadata=True, total=None):        
         meta = {
@@ -100,7 +425,9 @@ class ExtDirectStore(object):
             'idProperty': self.id_property
         }        
         res = serialize('extdirect', queryset, meta=meta, extras=self.extras,
-                        total=total, exclude_fields=self.exclude_fields)
+                        total=total, exclude_fields=self.exclude_fields,
+                        streaming=self.streaming, chunk_size=self.chunk_size,
+                        values=self.values, columns=self.columns)
         
         if metadata and self.metadata:            
             res['metaData'] = self.metadata        
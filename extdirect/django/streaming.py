@@ -0,0 +1,137 @@
+from itertools import chain, islice
+
+from django.db import close_connection
+
+class RecordStream(object):
+    """
+    Lazy list of records.
+
+    ExtDirectStore puts this object in the `root` of the response when it's
+    created with `streaming=True`. The router will encode the records
+    by chunks of `chunk_size`, while the response it's being sent.
+    """
+    def __init__(self, records, chunk_size=500):
+        self.records = records
+        self.chunk_size = chunk_size
+        self.prefetched = False
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def prefetch(self):
+        """
+        Fetch the first chunk of records now, so the query runs (and fails)
+        before the response it's sent.
+        """
+        if not self.prefetched:
+            records = iter(self.records)
+            self.records = chain(list(islice(records, self.chunk_size)), records)
+            self.prefetched = True
+
+    def iter_json(self, encoder):
+        yield '['
+        sep = ''
+        chunk = []
+        for rec in self.records:
+            chunk.append(rec)
+            if len(chunk) == self.chunk_size:
+                yield sep + encoder.encode(chunk)[1:-1]
+                sep = ', '
+                chunk = []
+        if chunk:
+            yield sep + encoder.encode(chunk)[1:-1]
+        yield ']'
+
+class RawJSON(object):
+    """
+    Already encoded JSON. The router puts the `content` as it's
+    in the response, e.g. a page cached by ExtDirectStore.
+    """
+    def __init__(self, content):
+        self.content = content
+
+    def iter_json(self, encoder):
+        yield self.content
+
+def _streams(response):
+    """
+    Return the (container, key, stream) for every RecordStream or RawJSON in the
+    response. We only look for them in the `result` of each call (that's where
+    ExtDirectStore put them) and in the `result` itself.
+    """
+    found = []
+    if isinstance(response, dict):
+        response = [response]
+    for single in response:
+        result = single.get('result')
+        if isinstance(result, RawJSON):
+            found.append((single, 'result', result))
+        elif isinstance(result, dict):
+            for key, value in result.items():
+                if isinstance(value, (RecordStream, RawJSON)):
+                    found.append((result, key, value))
+    return found
+
+def is_streamed(response):
+    return bool(_streams(response))
+
+def prefetch(result):
+    """
+    Prefetch every RecordStream in the `result` of a call.
+    """
+    for container, key, stream in _streams({'result': result}):
+        if isinstance(stream, RecordStream):
+            stream.prefetch()
+
+class StreamedResponse(object):
+    """
+    Iterable content for a HttpResponse, encoding the Ext.Direct response
+    incrementally. Every RecordStream (or RawJSON) it's replaced by a placeholder,
+    the envelope it's encoded as usual and then we fill the placeholders
+    with the encoded records.
+    """
+    def __init__(self, response, encoder):
+        self.response = response
+        self.encoder = encoder
+
+    @property
+    def lazy(self):
+        """
+        False if there isn't any RecordStream, so the content could be joined
+        before sending it (e.g. a response with cached pages only).
+        """
+        for container, key, stream in _streams(self.response):
+            if isinstance(stream, RecordStream):
+                return True
+        return False
+
+    def __iter__(self):
+        streams = _streams(self.response)
+        placeholders = {}
+        for i, (container, key, stream) in enumerate(streams):
+            placeholder = '__extdirect_stream_%d_%d__' % (i, id(stream))
+            placeholders['"%s"' % placeholder] = stream
+            container[key] = placeholder
+
+        envelope = self.encoder.encode(self.response)
+        for piece in self._split(envelope, placeholders):
+            if isinstance(piece, (RecordStream, RawJSON)):
+                for chunk in piece.iter_json(self.encoder):
+                    yield chunk
+            else:
+                yield piece
+
+    def _split(self, envelope, placeholders):
+        pending = [(envelope.find(p), p) for p in placeholders]
+        pending.sort()
+        pos = 0
+        for index, placeholder in pending:
+            yield envelope[pos:index]
+            yield placeholders[placeholder]
+            pos = index + len(placeholder)
+        yield envelope[pos:]
+
+    def close(self):
+        #The records are fetched after the `request_finished` signal was sent,
+        #so we release the database connection as Django does at the end of a request.
+        close_connection()
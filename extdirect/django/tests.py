@@ -54,5 +54,124 @@ def suite():
         tearDown=tearDown,
         globs=globs))
     
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/batch.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/streaming.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/values.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/queries.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/keyset.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/totals.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/bulk.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/cache.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/instrumentation.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/encoders.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/parsing.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/dispatch.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/longpoll.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/multipolling.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/arrays.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/compression.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+
+    suite.addTest(doctest.DocFileSuite(
+        './doctests/filters.txt',
+        optionflags=optionflags,
+        setUp=setUp,
+        tearDown=tearDown,
+        globs=globs))
+    
     return suite
 
@@ -0,0 +1,142 @@
+"""
+Strategies to get the `total` of an ExtDirectStore read.
+
+Each strategy implements `total(queryset)`, where `queryset` it's already
+filtered (but not paginated), and `exact` tells if it's always the real count.
+You could give an instance to ExtDirectStore using `total_strategy`.
+"""
+import re, threading
+
+from django.core.cache import cache
+from django.db import connections, DatabaseError
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from extdirect.django.cache import cache_key, model_version
+
+_lock = threading.Lock()
+_metrics = {}
+
+def record(path):
+    _lock.acquire()
+    try:
+        _metrics[path] = _metrics.get(path, 0) + 1
+    finally:
+        _lock.release()
+
+def metrics():
+    """
+    Return how many times each path was used, something like::
+
+        {'exact': 10, 'cached': 25, 'cache_miss': 3, 'estimated': 7, 'estimate_fallback': 1}
+    """
+    _lock.acquire()
+    try:
+        return dict(_metrics)
+    finally:
+        _lock.release()
+
+def reset_metrics():
+    _lock.acquire()
+    try:
+        _metrics.clear()
+    finally:
+        _lock.release()
+
+class ExactTotal(object):
+    """
+    Run a COUNT query every time (the default).
+    """
+    exact = True
+
+    def total(self, queryset):
+        record('exact')
+        return queryset.count()
+
+class CachedTotal(ExactTotal):
+    """
+    Cache the result of the COUNT query for `timeout` seconds.
+
+    The key it's built from the model (and its version, see `extdirect.django.cache`)
+    and the SQL of the query, that is, the filter kwargs normalized by the ORM.
+    ExtDirectCRUD invalidates the model version after every create, update or destroy.
+    """
+    #Stale if the data was changed in another way within the `timeout`
+    exact = False
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+
+    def total(self, queryset):
+        try:
+            sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            record('exact')
+            return 0
+
+        model = queryset.model
+        key = cache_key('extdirect:total', model._meta.app_label, model._meta.object_name,
+                        model_version(model), sql, params)
+        total = cache.get(key)
+        if total is None:
+            record('cache_miss')
+            total = queryset.count()
+            cache.set(key, total, self.timeout)
+        else:
+            record('cached')
+        return total
+
+class EstimatedTotal(ExactTotal):
+    """
+    Use the row count estimated by the database planner.
+
+     - PostgreSQL: the `rows` of the top node of EXPLAIN.
+     - SQLite: the row count of the table in `sqlite_stat1` (you need to run ANALYZE),
+       only for queries without conditions.
+
+    When the database can't estimate the total, or the estimate it's lower
+    than `exact_below`, we run the COUNT query anyway.
+    """
+    exact = False
+    rows = re.compile(r'rows=(\d+)')
+
+    def __init__(self, exact_below=1000):
+        self.exact_below = exact_below
+
+    def total(self, queryset):
+        connection = connections[queryset.db]
+        engine = connection.settings_dict['ENGINE'].split('.')[-1]
+
+        estimate = None
+        try:
+            if engine.startswith('postgresql'):
+                estimate = self.postgresql(queryset, connection)
+            elif engine == 'sqlite3':
+                estimate = self.sqlite(queryset, connection)
+        except (DatabaseError, EmptyResultSet):
+            estimate = None
+
+        if estimate is None or estimate < self.exact_below:
+            record('estimate_fallback')
+            return queryset.count()
+
+        record('estimated')
+        return estimate
+
+    def postgresql(self, queryset, connection):
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ' + sql, params)
+        match = self.rows.search(cursor.fetchone()[0])
+        if match:
+            return int(match.group(1))
+
+    def sqlite(self, queryset, connection):
+        query = queryset.query
+        if query.where.children or query.distinct or query.low_mark or query.high_mark:
+            return None
+        cursor = connection.cursor()
+        cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+        if row:
+            return int(row[0].split()[0])